@@ -4,7 +4,7 @@ This module implements some of the ideas from the paper:
         Distributed Optimization and Statistical Learning via the Alternating Direction Method of Multipliers
         by Stephen Boyd, Neal Parikh, Eric Chu, Borja Peleato, Jonathan Eckstein
 
-for the Disco framework.
+on a pool of local processes.
 
 Distributed Model Fitting
 =========================
@@ -37,35 +37,184 @@ if K * N becomes too large, then we need a way to either:
 
 (b) is more efficient, but messier
 
+Here we do (b): each worker process loads its partitions (A_i, b_i) once,
+and keeps them resident, along with their (x_i, y_i), between iterations.
+Each iteration only broadcasts the N-vector z (and rho), and gathers back
+the sums of (over-relaxed) x_i + y_i / rho, x_i and ||x_i||^2, from which the workers' average
+(and so the next z) and the primal residual follow.
+
+For instance, least squares:
+
+>>> random = numpy.random.RandomState(0)
+>>> A, x = random.randn(400, 5), random.randn(5)
+>>> b = A.dot(x) + .01 * random.randn(400)
+>>> admm = ADMM([(A[i::4], b[i::4]) for i in range(4)], processes=2)
+>>> z = admm.solve(eta_conv=1e-8, eta_feas=1e-8)
+>>> abs(z - numpy.linalg.lstsq(A, b, rcond=None)[0]).max() < 1e-6
+True
+>>> admm.close()
+
+The number of rounds depends on rho, which is why it can be balanced as the residuals come,
+and on over-relaxation:
+
+>>> parts = [(10 * A[i::4], 10 * b[i::4]) for i in range(4)]
+>>> rounds = []
+>>> admm = ADMM(parts, processes=2)
+>>> z = admm.solve(hook=rounds.append)
+>>> admm.close()
+>>> len(rounds), rounds[-1].rho
+(1000, 1.0)
+>>> rounds = []
+>>> admm = ADMM(parts, processes=2)
+>>> z = admm.solve(alpha=1.6, mu=10., hook=rounds.append)
+>>> admm.close()
+>>> len(rounds), rounds[-1].rho
+(210, 128.0)
 """
-from disco.core import Job, Params, RecordIter
-
-class ADMM(Job):
-    def map_reader(fd, url, size, params):
-        i = Task.id
-        z = params.z
-        yi = params.y[i] + params.rho * (params.x[i] - z)
-        for A, b in iter:
-            xi = argmin(fi(x) + dot(yi, x - z) + (params.rho / 2.) * dot(x - z, x - z))
-            yield str(i), (xi, yi)
-
-    def reduce(iter, params):
-        for n, (i, (xi, yi)) in enumerate(iter):
-            zhat += xi + yi / float(params.rho)
-        yield zhat / n
-
-# first run a job to put records into A, b format
-# and also calculate a first z
-
-if __name__ == '__main__':
-    params = Params(rho=1., z=0., objective=)
-
+import collections
+import multiprocessing
+import time
+import numpy
+from scipy.linalg import cho_factor, cho_solve
+
+class Squares(object):
+    """
+    The loss 1/2 ||A x - b||^2, whose x-update is a linear solve.
+
+    The Cholesky factor of A'A + rho I is kept, and refactored only when rho changes.
+    """
+    def __init__(self, A, b):
+        self.A = A
+        self.b = b
+        self.Ab = A.T.dot(b)
+        self.rho = None
+
+    def update(self, v, rho, x, tol):
+        """Return argmin loss(x) + (rho / 2) ||x - v||^2 (exactly, so neither `x` nor `tol` is needed)."""
+        if rho != self.rho:
+            self.factor = cho_factor(self.A.T.dot(self.A) + rho * numpy.eye(self.A.shape[1]))
+            self.rho = rho
+        return cho_solve(self.factor, self.Ab + rho * v)
+
+class Round(collections.namedtuple('Round', 'n primal dual rho seconds')):
+    """The residuals after iteration `n`, the rho it used, and the `seconds` since the solve started."""
+
+class Partition(object):
+    """
+    The resident state of one partition: its loss, its (x_i, y_i),
+    and the relaxed x_i and rho its next y-update needs.
+    """
+    def __init__(self, loss):
+        self.loss = loss
+        self.x = numpy.zeros(loss.A.shape[1])
+        self.y = numpy.zeros(loss.A.shape[1])
+        self.xhat = self.x
+        self.rho = None
+
+    def step(self, z, rho, tol, alpha):
+        if self.rho:
+            self.y += self.rho * (self.xhat - z)
+        self.x = self.loss.update(z - self.y / rho, rho, self.x, tol)
+        self.xhat = alpha * self.x + (1 - alpha) * z
+        self.rho = rho
+
+def serve(conn, partitions, loss):
+    """Load the `partitions` (pairs (A, b), or functions returning them), and step them for each z received."""
+    parts = [Partition(loss(*(p() if callable(p) else p))) for p in partitions]
+    conn.send(parts[0].x.shape[0] if parts else None)
     while True:
-        job = ADMM()
-        results = job.wait()
-        z = old_z
-        params.z = list(RecordIter(job.results()))[0]
-        if params.rho * sqrt(n) * pnorm(z - params.z, p=2) <= eta_conv:
-            if sum(dot(xi - params.z, xi - params.z)
-                   for xi, yi in RecordIter(results)) <= (eta_feas ** 2):
+        message = conn.recv()
+        if message is None:
+            break
+        z, rho, tol, alpha = message
+        for part in parts:
+            part.step(z, rho, tol, alpha)
+        conn.send((sum(p.xhat + p.y / rho for p in parts),
+                   sum(p.x for p in parts),
+                   sum(p.x.dot(p.x) for p in parts)))
+    conn.close()
+
+class ADMM(object):
+    """
+    Consensus ADMM over data `partitions`, split among `processes` workers (one per cpu, by default).
+
+    Each partition is a pair (A_i, b_i), or a function returning one (called in its worker),
+    and `loss(A_i, b_i)` gives the object that performs its x-updates,
+    to within a tolerance that starts at `tol` and shrinks along with the residuals.
+    The z-update is the average of x_i + y_i / rho (with x_i over-relaxed by `alpha`), passed through `prox(v, t)`, if given:
+    for a regularization g(z), it should return argmin t g(z) + 1/2 ||z - v||^2 (with t = 1 / (K rho)),
+    so for the indicator of a set, it is the projection onto the set.
+
+    The penalty starts at `rho`, and each call to `solve` goes on from the state the last one left.
+    """
+    def __init__(self, partitions, loss=Squares, processes=None, prox=None, tol=1e-2, rho=1.):
+        self.K = len(partitions)
+        self.prox = prox
+        self.tol = tol
+        self.rho = rho
+        P = min(processes or multiprocessing.cpu_count(), self.K)
+        self.conns, self.workers = [], []
+        for w in xrange(P):
+            conn, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=serve, args=(child, partitions[w::P], loss))
+            worker.daemon = True
+            worker.start()
+            self.conns.append(conn)
+            self.workers.append(worker)
+        self.N = [conn.recv() for conn in self.conns][0]
+        self.z = numpy.zeros(self.N)
+
+    def round(self, z, rho, tol, alpha):
+        """Step every partition, and return the sums of xhat_i + y_i / rho, x_i and ||x_i||^2."""
+        for conn in self.conns:
+            conn.send((z, rho, tol, alpha))
+        return [sum(s) for s in zip(*[conn.recv() for conn in self.conns])]
+
+    def solve(self, eta_conv=1e-4, eta_feas=1e-4, limit=1000, alpha=1., mu=None, tau=2., hook=None):
+        """
+        Iterate (from the current state) until the residuals are small enough, and return z.
+
+        Stops once the dual residual rho sqrt(K) ||z - z_old|| is within `eta_conv`,
+        and the primal residual sqrt(sum ||x_i - z||^2) is within `eta_feas`, or after `limit` iterations.
+        The x_i are over-relaxed by `alpha` (1.5 to 1.8 often helps).
+        If `mu` is given, rho is balanced: multiplied by `tau` when the primal residual is over `mu` times the dual,
+        and divided by it in the opposite case (the y_i are unscaled, so they carry over as they are).
+        If `hook` is given, it is called with the `Round` of each iteration, and can stop the solve by returning False.
+        """
+        K, z, rho = self.K, self.z, self.rho
+        start = time.time()
+        for n in xrange(limit):
+            s, sx, sxx = self.round(z, rho, self.tol, alpha)
+            z_old, z = z, s / K
+            if self.prox:
+                z = self.prox(z, 1. / (K * rho))
+            self.primal = max(sxx - 2 * z.dot(sx) + K * z.dot(z), 0) ** .5
+            self.dual = rho * K ** .5 * numpy.linalg.norm(z - z_old)
+            self.tol = max(min(self.tol, .1 * min(self.primal, self.dual) / K ** .5), 1e-12)
+            if hook is not None and hook(Round(n, self.primal, self.dual, rho, time.time() - start)) is False:
+                break
+            if self.dual <= eta_conv and self.primal <= eta_feas:
                 break
+            if mu is not None:
+                if self.primal > mu * self.dual:
+                    rho *= tau
+                elif self.dual > mu * self.primal:
+                    rho /= tau
+        self.z, self.rho = z, rho
+        return z
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for worker in self.workers:
+            worker.join()
+
+if __name__ == '__main__':
+    import sys
+    random = numpy.random.RandomState(0)
+    A, x = random.randn(100000, 50), random.randn(50)
+    b = A.dot(x) + random.randn(100000)
+    admm = ADMM([(A[i::16], b[i::16]) for i in range(16)])
+    z = admm.solve(alpha=1.6, mu=10., hook=lambda r: r.n % 10 or sys.stdout.write('%r\n' % (r,)))
+    print abs(z - x).max(), admm.primal, admm.dual
+    admm.close()
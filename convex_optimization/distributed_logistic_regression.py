@@ -1,26 +1,83 @@
-from disco.core import Job, Params, RecordIter
+"""
+Logistic regression, fitted by consensus ADMM (see `admm`) over partitions of the examples.
 
-class LogisticRegress(Job):
-    def map_reader(fd, url, size, params):
-        i = Task.id
-        z = params.z
-        y = params.y[i] + params.rho * (params.x[i] - z)
-        for A, b in iter:
-            x = ...
-            yield str(i), (x, y)
+The labels b are +-1, and each partition's loss is sum_j log(1 + exp(-b_j a_j' x)).
+Its x-update has no closed form, so `Logistic` solves it by Newton's method, with conjugate gradient
+steps that only need Hessian-vector products (so A may be a scipy.sparse matrix).
+Each solve is warm-started from the partition's previous x_i, and only run to the tolerance
+the engine passes, which it tightens as its residuals shrink.
 
-    def reduce(iter, params):
-        for n, (i, (x, y)) in enumerate(iter):
-            zhat += x + y / float(params.rho)
-            yield i, (x, y)
-        oob.put('z', zhat / n)
+>>> random = numpy.random.RandomState(0)
+>>> A = random.randn(600, 4)
+>>> b = numpy.where(A.dot([1., -2., .5, 0.]) + random.logistic(size=600) > 0, 1., -1.)
+>>> admm = ADMM([(A[i::3], b[i::3]) for i in range(3)], loss=Logistic, processes=3)
+>>> z = admm.solve(eta_conv=1e-7, eta_feas=1e-7)
+>>> admm.close()
+>>> x = Logistic(A, b).update(numpy.zeros(4), 0., numpy.zeros(4), 1e-10)
+>>> abs(z - x).max() < 1e-5
+True
+>>> from scipy.sparse import csr_matrix
+>>> abs(Logistic(csr_matrix(A), b).update(numpy.zeros(4), 0., numpy.zeros(4), 1e-10) - x).max() < 1e-10
+True
+"""
+import numpy
+from scipy.special import expit
+from admm import ADMM
 
-if __name__ == '__main__':
-    params = Params(rho=1., z=0)
+class Logistic(object):
+    """The loss sum_j log(1 + exp(-b_j a_j' x)) of the examples (A, b), with b in {-1, 1}."""
+    def __init__(self, A, b):
+        self.A = A
+        self.b = numpy.asarray(b, dtype=float)
+
+    def value(self, x, v, rho):
+        return numpy.logaddexp(0, -self.b * self.A.dot(x)).sum() + rho / 2. * (x - v).dot(x - v)
 
-    while True:
-        job = LogisticRegress(params=params)
-        results = job.wait()
-        for i, (x, y) in RecordIter(job.wait()):
+    def update(self, v, rho, x, tol):
+        """Return argmin loss(x) + (rho / 2) ||x - v||^2, by Newton-CG from `x`, until the gradient is within `tol`."""
+        A, b = self.A, self.b
+        x = x.copy()
+        f = self.value(x, v, rho)
+        for n in xrange(50):
+            s = expit(-b * A.dot(x))
+            g = -A.T.dot(b * s) + rho * (x - v)
+            if numpy.linalg.norm(g) <= tol:
+                break
+            D = s * (1 - s)
+            d = cg(lambda u: A.T.dot(D * A.dot(u)) + rho * u, -g, min(.5, numpy.linalg.norm(g) ** .5))
+            step, slope = 1., g.dot(d)
+            while True:
+                f_ = self.value(x + step * d, v, rho)
+                if f_ <= f + 1e-4 * step * slope or step < 1e-10:
+                    break
+                step /= 2
+            x += step * d
+            f = f_
+        return x
 
+def cg(H, g, eta):
+    """Approximately solve H d = g, for the positive definite H (a function), to relative residual `eta`."""
+    d = numpy.zeros_like(g)
+    r = g.copy()
+    p = r.copy()
+    rr = r.dot(r)
+    for n in xrange(len(g)):
+        if rr <= (eta * numpy.linalg.norm(g)) ** 2:
+            break
+        Hp = H(p)
+        alpha = rr / p.dot(Hp)
+        d += alpha * p
+        r -= alpha * Hp
+        rr, rr_ = r.dot(r), rr
+        p = r + (rr / rr_) * p
+    return d
 
+if __name__ == '__main__':
+    from scipy.sparse import rand
+    random = numpy.random.RandomState(0)
+    A = rand(50000, 200, density=.02, format='csr', random_state=random)
+    b = numpy.where(A.dot(random.randn(200)) + random.logistic(size=50000) > 0, 1., -1.)
+    admm = ADMM([(A[i::8], b[i::8]) for i in range(8)], loss=Logistic)
+    z = admm.solve(limit=200)
+    print admm.primal, admm.dual
+    admm.close()
@@ -1,17 +1,156 @@
+"""
+Design matrices from inverted indices of log records: a row per feature, a column per record.
+
+The triples are streamed into a `Builder`'s growable arrays, rather than materialized as tuples,
+and can be had as a cvxopt `spmatrix` (`matrix`), or as a scipy CSC or CSR matrix,
+which `save` writes in a format `load` memory-maps back:
+
+>>> import os, tempfile
+>>> I = Numeric([(('size', 2.), [0, 3]), (('size', 5.), [1]), (('port', 80.), [0, 1, 2])])
+>>> A = I.builder().tocsc()
+>>> A.shape, A.nnz
+((3, 4), 6)
+>>> sorted(zip(*A.nonzero())) == sorted((n, id) for n, ids in I.values() for id in ids)
+True
+>>> path = os.path.join(tempfile.mkdtemp(), 'design')
+>>> save(A, path)
+>>> B = load(path)
+>>> B.format, (B != A).nnz, B.data.flags.writeable
+('csc', 0, False)
+>>> os.remove(path)
+
+New records (and keys) can be added as they come, without disturbing the rows already assigned,
+and the matrix grows in place; or, for unbounded vocabularies, keys can be hashed into a fixed number of rows:
+
+>>> I.add([(('port', 80.), [4]), (('port', 22.), [4])])
+>>> I[('port', 80.)], I[('port', 22.)]
+((2, [0, 1, 2, 4]), (3, [4]))
+>>> I.builder().tocsr().shape
+(4, 5)
+>>> H = Indicator([('a', [0]), ('b', [1, 2]), ('c', [2])], rows=2)
+>>> H.builder().tocsr().toarray()
+array([[1., 0., 1.],
+       [0., 1., 1.]])
+>>> len(H)
+0
+>>> I[('port', 22.)] = (0, [])
+Traceback (most recent call last):
+    ...
+TypeError: Numeric entries can only be added, with `add`
+"""
 def strval(string):
     return sum(ord(c) * 10**-n for n, c in enumerate(string.lower()))
 
-from itertools import izip
-from cvxopt import spmatrix
+import ast
+import struct
+import zlib
+import numpy
+from cvxopt import matrix, spmatrix
+from scipy.sparse import coo_matrix, csc_matrix, csr_matrix
+
+MAGIC = 'PHDSPARSE'
+VERSION = 1
+ALIGN = 64
+
+class Builder(object):
+    """
+    A sparse matrix, as (row, col, val) triples appended to growable int32 / int32 / float64 arrays.
+    """
+    def __init__(self, capacity=1024, shape=None):
+        self.rows = numpy.empty(capacity, dtype=numpy.int32)
+        self.cols = numpy.empty(capacity, dtype=numpy.int32)
+        self.vals = numpy.empty(capacity, dtype=numpy.float64)
+        self.n = 0
+        self.shape = shape
+
+    def __len__(self):
+        return self.n
+
+    def reserve(self, size):
+        """Make room for `size` triples in all, at least doubling the arrays when they must grow."""
+        if size > len(self.rows):
+            size = max(size, 2 * len(self.rows))
+            for name in ('rows', 'cols', 'vals'):
+                array = getattr(self, name)
+                grown = numpy.empty(size, dtype=array.dtype)
+                grown[:self.n] = array[:self.n]
+                setattr(self, name, grown)
+
+    def append(self, row, cols, val=1.):
+        """Append the entries `val` at `row` and each of `cols`."""
+        cols = numpy.asarray(cols if hasattr(cols, '__len__') else list(cols), dtype=numpy.int32)
+        m = len(cols)
+        self.reserve(self.n + m)
+        self.rows[self.n:self.n + m] = row
+        self.cols[self.n:self.n + m] = cols
+        self.vals[self.n:self.n + m] = val
+        self.n += m
+
+    def tocoo(self):
+        n = self.n
+        return coo_matrix((self.vals[:n], (self.rows[:n], self.cols[:n])), shape=self.shape)
+
+    def tocsc(self):
+        return self.tocoo().tocsc()
+
+    def tocsr(self):
+        return self.tocoo().tocsr()
+
+    def spmatrix(self):
+        n = self.n
+        args = matrix(self.vals[:n]), matrix(self.rows[:n].astype(int)), matrix(self.cols[:n].astype(int))
+        return spmatrix(*args + ((self.shape,) if self.shape else ()))
+
+def readonly(self, *args, **kwargs):
+    raise TypeError("%s entries can only be added, with `add`" % type(self).__name__)
 
 class Indicator(dict):
-    def __init__(self, inverted):
+    def __init__(self, inverted=(), rows=None):
         """
         for key, ids in inverted:
           self[key] = (n, ids)
+
+        with `n` the next free row, or, given a fixed number of `rows`, the key's hashed row
+        (so keys may share rows, and their entries add up); hashed keys are not kept.
+        The entries cannot be changed or removed (only added), so that the matrix always matches.
         """
-        super(Indicator, self).__init__((key, (n, ids))
-                                        for n, (key, ids) in enumerate(inverted))
+        super(Indicator, self).__init__()
+        self.rows = rows
+        self.count = 0
+        self.entries = Builder()
+        self.add(inverted)
+
+    __setitem__ = __delitem__ = update = setdefault = pop = popitem = clear = readonly
+
+    def row(self, key):
+        if self.rows is not None:
+            return (zlib.crc32(repr(key)) & 0xffffffff) % self.rows
+        self.count += 1
+        return self.count - 1
+
+    def value(self, key):
+        return 1.
+
+    def add(self, inverted):
+        """Add more (key, ids) pairs: known keys keep their rows (and their ids are extended in place), new keys get new ones."""
+        for key, ids in inverted:
+            ids = ids if hasattr(ids, '__len__') else list(ids)
+            if self.rows is not None:
+                n = self.row(key)
+            elif key in self:
+                n, old = self[key]
+                old.extend(ids)
+            else:
+                n = self.row(key)
+                dict.__setitem__(self, key, (n, list(ids)))
+            self.entries.append(n, ids, self.value(key))
+
+    def builder(self):
+        """The `Builder` holding the entries of `matrix`, kept (and grown) as records are added."""
+        entries, n = self.entries, len(self.entries)
+        entries.shape = (self.count if self.rows is None else self.rows,
+                         int(entries.cols[:n].max()) + 1 if n else 0)
+        return entries
 
     @property
     def matrix(self):
@@ -24,11 +163,12 @@ class Indicator(dict):
 
         feature `i` exists in record `j`
         """
-        return spmatrix(1, *izip(*((n, id)
-                                   for n, ids in self.itervalues()
-                                   for id in ids)))
+        return self.builder().spmatrix()
 
 class Numeric(Indicator):
+    def value(self, (feature, val)):
+        return val
+
     @property
     def matrix(self):
         """
@@ -40,6 +180,39 @@ class Numeric(Indicator):
 
         feature `i` takes on value `val` in record `j`
         """
-        return spmatrix(*izip(*((val, n, id)
-                                for (feature, val), (n, ids) in self.iteritems()
-                                for id in ids)))
+        return self.builder().spmatrix()
+
+def save(A, path):
+    """Save the scipy CSC or CSR matrix `A` to `path`, in the format read by `load`."""
+    A = A if A.format in ('csc', 'csr') else A.tocsc()
+    arrays = [numpy.ascontiguousarray(A.data, dtype=numpy.float64),
+              numpy.ascontiguousarray(A.indices, dtype=numpy.int32),
+              numpy.ascontiguousarray(A.indptr)]
+    header = repr({'format': A.format, 'shape': A.shape,
+                   'dtypes': [a.dtype.str for a in arrays],
+                   'sizes': [len(a) for a in arrays]})
+    with open(path, 'wb') as file:
+        file.write(struct.pack('<%dsII' % len(MAGIC), MAGIC, VERSION, len(header)))
+        file.write(header)
+        for array in arrays:
+            file.write('\0' * (aligned(file.tell()) - file.tell()))
+            file.write(array.tostring())
+
+def load(path, mode='r'):
+    """Open a saved matrix, with its arrays memory-mapped from `path`."""
+    with open(path, 'rb') as file:
+        magic, version, size = struct.unpack('<%dsII' % len(MAGIC), file.read(len(MAGIC) + 8))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a sparse matrix (version %s): %s" % (VERSION, path))
+        header = ast.literal_eval(file.read(size))
+    offset, arrays = len(MAGIC) + 8 + size, []
+    for dtype, n in zip(header['dtypes'], header['sizes']):
+        offset = aligned(offset)
+        arrays.append(numpy.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=(n,)) if n else
+                      numpy.zeros(0, dtype=dtype))
+        offset += n * numpy.dtype(dtype).itemsize
+    cls = csc_matrix if header['format'] == 'csc' else csr_matrix
+    return cls(tuple(arrays), shape=header['shape'], copy=False)
+
+def aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
@@ -5,8 +5,40 @@ Unfortunately, we can't do anything useful, since we sometimes try to enumerate
 However, still a useful exercise, and especially interesting to discover warts in the theory.
 For instance, we don't differentiate between points and vectors,
 since it is anyways sometimes ambiguous in the book, but always clear from context what is meant.
+
+What we can do is test membership in, and project onto, (most of) the sets,
+for an (n, d) array of points at once (or a single point):
+
+>>> X = numpy.array([[0., 0.], [3., 4.], [-1., .5]])
+>>> B = ball((0., 0.), 1.)
+>>> B.contains(X)
+array([ True, False, False])
+>>> B.project(X)
+array([[ 0.        ,  0.        ],
+       [ 0.6       ,  0.8       ],
+       [-0.89442719,  0.4472136 ]])
+>>> from operator import le
+>>> H = halfspace((1., 1.), 1., le)
+>>> H.contains(X), H.project(X)[1]
+(array([ True, False,  True]), array([0., 1.]))
+>>> probability(2).project(X)
+array([[0.5, 0.5],
+       [0. , 1. ],
+       [0. , 1. ]])
+
+Projections land in the set, even from far away, and membership works for norms of single vectors too:
+
+>>> E = ellipsoid((0., 0.), numpy.diag([1., 100.]))
+>>> E.contains(E.project([[1e8, 1e8], [2., 0.]]))
+array([ True,  True])
+>>> ball((0., 0.), 1., norm=lambda u: max(abs(u_) for u_ in u)).contains(X)
+array([ True, False,  True])
+
+so that they can serve as the z-update of `admm.ADMM`, through `prox`.
 """
 from itertools import combinations, product
+from operator import eq
+import numpy
 
 class Reals(object):
     def __init__(self, *dimensions):
@@ -20,7 +52,11 @@ def dot(a, b):
     return sum(a_ * b_ for a_, b_ in zip(a, b))
 
 def pnorm(u, p=2):
-    return sum(abs(u_) ** p for u_ in u) ** (1. / p)
+    return numpy.linalg.norm(numpy.asarray(u, dtype=float), ord=p, axis=-1)
+
+def prox(S):
+    """The prox of the indicator of the set `S`, as `admm.ADMM` takes it: the projection onto `S`."""
+    return lambda v, t: S.project(v)
 
 def perspective(p):
     return (1. / p[-1] * point(p[:-1]))
@@ -73,25 +109,59 @@ class halfspace(set):
             if self.constraint(dot(self.normal, point), self.offset):
                 yield point
 
+    def residual(self, X):
+        """How far beyond the boundary the points are, along the normal (0 if on the allowed side)."""
+        r = numpy.asarray(X, dtype=float).dot(self.normal) - self.offset
+        below, above = self.constraint(-1., 0.), self.constraint(1., 0.)
+        return numpy.where(r > 0, 0 if above else r, 0 if below else r)
+
+    def contains(self, X, tol=1e-9):
+        return abs(self.residual(X)) <= tol
+
+    def project(self, X):
+        a = numpy.asarray(self.normal, dtype=float)
+        return X - (self.residual(X) / a.dot(a))[..., None] * a
+
 class hyperplane(halfspace):
     def __init__(self, normal, offset):
-        from operator import eq
         super(hyperplane, self).__init__(normal, offset, eq)
 
 class ball(set):
-    def __init__(self, center, radius, norm=lambda u: pnorm(u, p=2)):
+    """
+    The points within `radius` of `center`, in the p-norm, or some other `norm`
+    (we only know how to project for p = 1, 2 or inf).
+    """
+    def __init__(self, center, radius, norm=None, p=2):
         self.center = center
         self.radius = radius
-        self.norm = norm
+        self.norm = norm or (lambda u: pnorm(u, p=p))
+        self.p = None if norm else p
 
     def __iter__(self):
         for point in Reals(len(self.center)):
             if self.norm(point - self.center) <= self.radius:
                 yield point
 
+    def contains(self, X, tol=1e-9):
+        Y = numpy.asarray(X, dtype=float) - self.center
+        return (self.norm(Y) if self.p else rowwise(self.norm, Y)) <= self.radius + tol
+
+    def project(self, X):
+        Y, r = numpy.asarray(X, dtype=float) - self.center, self.radius
+        if self.p == 2:
+            return self.center + Y * numpy.minimum(1, r / numpy.maximum(pnorm(Y), 1e-300))[..., None]
+        if self.p == numpy.inf:
+            return self.center + numpy.clip(Y, -r, r)
+        if self.p == 1:
+            inside = (pnorm(Y, 1) <= r)[..., None]
+            return self.center + numpy.where(inside, Y, numpy.sign(Y) * project_simplex(abs(Y), r))
+        raise ValueError("can only project onto balls of the 1-, 2- or inf-norm (p in {1, 2, inf})")
+
 class ellipsoid(set):
+    """The points x with (x - center)' P^-1 (x - center) <= 1."""
     def __init__(self, center, P):
-        self.center, P = center, P
+        self.center, self.P = center, P
+        self.l, self.Q = numpy.linalg.eigh(numpy.asarray(P, dtype=float))
 
     def __iter__(self):
         for point in Reals(len(self.center)):
@@ -99,8 +169,40 @@ class ellipsoid(set):
             if (point - self.center) * inverse(P) * (point - self.center) <= 1:
                 yield point
 
+    def contains(self, X, tol=1e-9):
+        Y = (numpy.asarray(X, dtype=float) - self.center).dot(self.Q)
+        return (Y ** 2 / self.l).sum(-1) <= 1 + tol
+
+    def project(self, X, tol=1e-12, iterations=200):
+        """
+        Project, solving for each outside point's multiplier lam (where f(lam) = 0, below) by Newton's method,
+        safeguarded by bisection within the bracket sqrt(l_min) |y| - l_max <= lam <= sqrt(l_max) |y| - l_min.
+        Points not within `tol` after `iterations` take the upper end of their bracket, which is always feasible.
+        """
+        Y, l = (numpy.asarray(X, dtype=float) - self.center).dot(self.Q), self.l
+        r = pnorm(Y)
+        lo = numpy.maximum(l.min() ** .5 * r - l.max(), 0)
+        hi = numpy.maximum(l.max() ** .5 * r - l.min(), 0)
+        lam = lo
+        for n in xrange(iterations):
+            w = l / (l + lam[..., None])
+            f = (Y ** 2 * w ** 2 / l).sum(-1) - 1
+            if (f <= tol).all():
+                break
+            lo, hi = numpy.where(f > 0, lam, lo), numpy.where(f > 0, hi, lam)
+            df = -2 * (Y ** 2 * w ** 3 / l ** 2).sum(-1)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                step = lam - f / df
+            step = numpy.where((step > lo) & (step < hi), step, (lo + hi) / 2)
+            lam = numpy.where(f > tol, step, lam)
+        else:
+            w = l / (l + lam[..., None])
+            lam = numpy.where((Y ** 2 * w ** 2 / l).sum(-1) - 1 > tol, hi, lam)
+        return self.center + (Y * (l / (l + lam[..., None]))).dot(self.Q.T)
+
 class normcone(set):
-    def __init__(self, dimension, norm):
+    """The points (x, t) with norm(x) <= t (we only know how to project for the 2-norm)."""
+    def __init__(self, dimension, norm=pnorm):
         self.dimension = dimension
         self.norm = norm
 
@@ -109,6 +211,20 @@ class normcone(set):
             if self.norm(point[:-1]) <= point[-1]:
                 yield point
 
+    def contains(self, X, tol=1e-9):
+        X = numpy.asarray(X, dtype=float)
+        return (self.norm(X[..., :-1]) if self.norm is pnorm else rowwise(self.norm, X[..., :-1])) <= X[..., -1] + tol
+
+    def project(self, X):
+        if self.norm is not pnorm:
+            raise ValueError("can only project onto the 2-norm cone (norm=pnorm)")
+        X = numpy.asarray(X, dtype=float)
+        x, t = X[..., :-1], X[..., -1]
+        s = pnorm(x)
+        a = numpy.clip((s + t) / 2, 0, None)
+        Y = numpy.concatenate([x * (a / numpy.maximum(s, 1e-300))[..., None], a[..., None]], -1)
+        return numpy.where((s <= t)[..., None], X, Y)
+
 class polyhedron(set):
     """
     This is just a dummy, since you get a polyhedron if you intersect the other affine sets.
@@ -119,6 +235,46 @@ class simplex(polyhedron):
     Just take the convex hull of a set of affinely independent points.
     """
 
+class probability(simplex):
+    """The convex hull of the unit vectors (scaled by `radius`): x >= 0, sum x = radius."""
+    def __init__(self, dimension, radius=1.):
+        self.dimension = dimension
+        self.radius = radius
+
+    def contains(self, X, tol=1e-9):
+        X = numpy.asarray(X, dtype=float)
+        return (X >= -tol).all(-1) & (abs(X.sum(-1) - self.radius) <= tol)
+
+    def project(self, X):
+        return project_simplex(X, self.radius)
+
+def rowwise(norm, Y):
+    """Apply a `norm` of single vectors to each of the points."""
+    return numpy.apply_along_axis(norm, -1, Y)
+
+def project_simplex(X, r=1.):
+    """Project the points onto the simplex x >= 0, sum x = r, by sorting their coordinates."""
+    X = numpy.asarray(X, dtype=float)
+    U = -numpy.sort(-X, axis=-1)
+    css = U.cumsum(-1) - r
+    k = numpy.arange(1, X.shape[-1] + 1)
+    rho = (U - css / k > 0).sum(-1, keepdims=True)
+    theta = numpy.take_along_axis(css, rho - 1, -1) / rho
+    return numpy.maximum(X - theta, 0)
+
+class box(polyhedron):
+    """The points with lower <= x <= upper (coordinate-wise, with either a scalar or a vector bound)."""
+    def __init__(self, lower, upper):
+        self.lower = lower
+        self.upper = upper
+
+    def contains(self, X, tol=1e-9):
+        X = numpy.asarray(X, dtype=float)
+        return ((X >= numpy.subtract(self.lower, tol)) & (X <= numpy.add(self.upper, tol))).all(-1)
+
+    def project(self, X):
+        return numpy.clip(X, self.lower, self.upper)
+
 class hull(set):
     def __init__(self, points):
         self.points
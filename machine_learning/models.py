@@ -0,0 +1,135 @@
+"""
+Trained models, saved as a small header and contiguous weight blocks, and memory-mapped back.
+
+A `neural.network` is saved as its layers, a `regression.Logistic` (or a bare theta, as from `gl_regression`) as its theta,
+as float64, or (say) float32 to halve them. Loading maps the blocks read-only (by default),
+so the processes scoring with a model share one copy of it, and start without reading it all:
+
+>>> import os, tempfile
+>>> numpy.random.seed(0)
+>>> net = neural.network(3, 4, 2)
+>>> path = os.path.join(tempfile.mkdtemp(), 'model')
+>>> save(path, net)
+>>> net_ = load(path)
+>>> type(net_).__name__, [layer.shape for layer in net_], all((a == b).all() for a, b in zip(net, net_))
+('network', [(4, 4), (2, 5)], True)
+>>> (net_.score([1., 0., -1.]) == net.score([1., 0., -1.])).all(), net_[0].flags.writeable
+(True, False)
+>>> save(path, regression.Logistic(numpy.array([1., -2.])), dtype=numpy.float32)
+>>> load(path).theta
+memmap([ 1., -2.], dtype=float32)
+>>> os.remove(path)
+
+Many rows are best scored with `predict`, which works through them a chunk at a time (on a pool of threads),
+writing into `out`, if given:
+
+>>> X = numpy.random.randn(1000, 3)
+>>> out = numpy.empty((1000, 2))
+>>> predict(net, X, out=out, chunk=64, threads=4) is out, abs(out - net.score(X)).max() < 1e-12
+(True, True)
+>>> logit = regression.Logistic(numpy.array([1., -2., 800.]))
+>>> abs(predict(logit, X, chunk=100) - logit(X)).max(), predict(logit, numpy.array([[0., 0., -1.], [0., 0., 1.]]))
+(0.0, array([0., 1.]))
+
+including sparse rows, for a float32 network (as `save` can make), or an integer theta:
+
+>>> from scipy.sparse import csr_matrix
+>>> half = neural.network()
+>>> half.extend(layer.astype(numpy.float32) for layer in net)
+>>> abs(predict(half, csr_matrix(X), chunk=300) - net.score(X)).max() < 1e-5
+True
+>>> predict(regression.Logistic(numpy.array([0, 0, 1])), numpy.array([[0., 0., -800.], [0., 0., 0.]]))
+array([0. , 0.5])
+"""
+import ast
+import struct
+from multiprocessing.pool import ThreadPool
+import numpy
+from scipy.sparse import issparse
+import neural
+import regression
+
+MAGIC = 'PHDMODEL'
+VERSION = 1
+ALIGN = 64
+
+def save(path, model, dtype=None):
+    """Save the network, Logistic or theta `model` to `path`, with its weights as `dtype` (by default, as they are)."""
+    if isinstance(model, neural.network):
+        kind, arrays = 'network', list(model)
+    elif isinstance(model, regression.Logistic):
+        kind, arrays = 'logistic', [model.theta]
+    else:
+        kind, arrays = 'theta', [model]
+    arrays = [numpy.ascontiguousarray(a, dtype=dtype or numpy.asarray(a).dtype) for a in arrays]
+    header = repr({'kind': kind,
+                   'dtypes': [a.dtype.str for a in arrays],
+                   'shapes': [a.shape for a in arrays]})
+    with open(path, 'wb') as file:
+        file.write(struct.pack('<%dsII' % len(MAGIC), MAGIC, VERSION, len(header)))
+        file.write(header)
+        for array in arrays:
+            file.write('\0' * (aligned(file.tell()) - file.tell()))
+            file.write(array.tostring())
+
+def load(path, mode='r'):
+    """
+    Open a saved model, with its weights memory-mapped from `path`
+    (read-only, unless `mode` is 'c' (copy-on-write) or 'r+' (written through), say to train it further).
+    """
+    with open(path, 'rb') as file:
+        magic, version, size = struct.unpack('<%dsII' % len(MAGIC), file.read(len(MAGIC) + 8))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a model (version %s): %s" % (VERSION, path))
+        header = ast.literal_eval(file.read(size))
+    offset, arrays = len(MAGIC) + 8 + size, []
+    for dtype, shape in zip(header['dtypes'], header['shapes']):
+        offset = aligned(offset)
+        arrays.append(numpy.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=shape))
+        offset += int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize
+    if header['kind'] == 'network':
+        net = neural.network()
+        net.extend(arrays)
+        return net
+    if header['kind'] == 'logistic':
+        return regression.Logistic(arrays[0])
+    return arrays[0]
+
+def predict(model, X, out=None, chunk=65536, threads=None):
+    """
+    Score the rows of `X` (an array, memory-mapped or not, or a scipy.sparse matrix) with the network or Logistic `model`,
+    `chunk` rows at a time, on a pool of `threads` (if given), and return them, in `out` if given
+    (a C-contiguous array of the model's dtype).
+    """
+    if isinstance(model, neural.network):
+        shape, dtype = (X.shape[0], model[-1].shape[0]), model[-1].dtype
+    else:
+        shape, dtype = (X.shape[0],), numpy.result_type(numpy.asarray(model.theta).dtype, numpy.float32)
+    if out is None:
+        out = numpy.empty(shape, dtype=dtype)
+    def score(i):
+        Xc, outc = X[i:i + chunk], out[i:i + chunk]
+        if isinstance(model, neural.network):
+            O = Xc.toarray().astype(model[0].dtype, copy=False) if issparse(Xc) else numpy.asarray(Xc, dtype=model[0].dtype)
+            for n, W in enumerate(model):
+                Y = outc if n == len(model) - 1 else numpy.empty((len(O), W.shape[0]), dtype=W.dtype)
+                numpy.dot(O, W[:, :-1].T, out=Y)
+                Y += W[:, -1]
+                O = numpy.tanh(Y, out=Y)
+        else:
+            outc[:] = Xc.dot(model.theta)
+            regression.logistic(outc, out=outc)
+    starts = xrange(0, shape[0], chunk)
+    if threads:
+        pool = ThreadPool(threads)
+        try:
+            pool.map(score, starts)
+        finally:
+            pool.close()
+    else:
+        for i in starts:
+            score(i)
+    return out
+
+def aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
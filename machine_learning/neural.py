@@ -1,46 +1,170 @@
-from math import tanh
-from random import random
+"""
+A feed-forward network of tanh neurons, trained by backpropagation.
 
-def dot(a, b):
-    return sum(x * y for x, y in zip(a, b))
+Each layer is a contiguous weight matrix, with a row per neuron and a column per input (plus a bias),
+so that `forward`, `learn` and `score` take either a single input, or a mini-batch of them (as rows):
+
+>>> numpy.random.seed(0)
+>>> X, T = numpy.array([[0, 0], [0, 1], [1, 0], [1, 1]]), numpy.array([[-1], [1], [1], [-1]])
+>>> net = network(2, 2, 1)
+>>> while net.learn(X, T, rate=.2) > 1e-3:
+...     pass
+>>> numpy.sign(net.score(X)).ravel(), numpy.sign(net.score([0, 1]))
+(array([-1.,  1.,  1., -1.]), array([1.]))
+
+Data bigger than memory can be fed to `fit` as memory-mapped arrays, or as a function returning
+an iterable of (X, T) chunks (which should come in the same order each time).
+It is read a buffer at a time, shuffled within the buffer, and learnt from in mini-batches,
+for as many epochs as the error on the held-out rows (the first ones, unless `validation` is given) keeps improving:
+
+>>> import os, tempfile
+>>> random = numpy.random.RandomState(0)
+>>> path = os.path.join(tempfile.mkdtemp(), 'X')
+>>> X = numpy.memmap(path, dtype=numpy.float64, mode='w+', shape=(5000, 2))
+>>> X[:] = random.uniform(-1, 1, (5000, 2))
+>>> T = numpy.sign(X[:, :1] * X[:, 1:])
+>>> net = network(2, 8, 1)
+>>> epochs = net.fit((X, T), size=1000, rate=.1, patience=3, seed=0)
+>>> len(epochs) < 100, epochs[-1].samples, epochs[-1].rate > 0
+(True, 4500, True)
+>>> min(e.validation for e in epochs) < .1
+True
+>>> network(2, 1).fit((X[:8], T[:8]))
+Traceback (most recent call last):
+    ...
+ValueError: nothing to hold out for validation (give more rows, a larger holdout, or a validation pair)
+>>> del X; os.remove(path)
+"""
+import collections
+import time
+import numpy
+
+class Epoch(collections.namedtuple('Epoch', 'n error validation samples seconds rate')):
+    """
+    The training error (summed over its `samples`) and mean validation error of epoch `n`,
+    the `seconds` it took, and the samples per second.
+    """
+
+def bias(O):
+    return numpy.concatenate([O, numpy.ones(O.shape[:-1] + (1,), dtype=O.dtype)], -1)
 
 class network(list):
-    def __init__(self, *shape):
+    def __init__(self, *shape, **kwds):
+        dtype = kwds.get('dtype', numpy.float64)
         for i, N in enumerate(shape[:-1]):
-            self.append([[random() for _ in xrange(N + 1)] for _ in xrange(shape[i + 1])])
+            self.append(numpy.random.random((shape[i + 1], N + 1)).astype(dtype))
 
     def forward(self, X):
-        Ds, Os = [], [X + [1.]]
+        Ds, Os = [], [bias(numpy.asarray(X, dtype=self[0].dtype))]
         for layer in self:
-            Y = [tanh(dot(neuron, Os[-1])) for neuron in layer]
-            Ds.append([1 - y * y for y in Y])
-            Os.append(Y + [1.])
+            Y = numpy.tanh(Os[-1].dot(layer.T))
+            Ds.append(1 - Y * Y)
+            Os.append(bias(Y))
         return Ds, Os
 
     def reverse(self, Ds):
-        deltas = [Ds[-1]]
-        for layer, D in reversed(zip(self[1:] + [[[1.] * len(self[-1])]], Ds[:-1])):
-            deltas.insert(0, [di * dot([n[i] for n in layer], deltas[0]) for i, di in enumerate(D)])
-        return deltas
+        deltas = [Ds[-2] * Ds[-1]]
+        for layer, D in reversed(zip(self[1:], Ds[:-2])):
+            deltas.append(D * deltas[-1].dot(layer[:, :-1]))
+        return deltas[::-1]
 
     def learn(self, X, T, rate=.05):
+        """Take a gradient step on the (mean) error of the input(s) `X`, and return their total squared error / 2."""
         Ds, Os = self.forward(X)
-        Ds.append([oi - ti for oi, ti in zip(Os[-1], T)])
-        Os.append([di ** 2 / 2. for di in Ds[-1]])
+        Ds.append(Os[-1][..., :-1] - T)
         deltas = self.reverse(Ds)
+        n = len(Os[0]) if Os[0].ndim > 1 else 1
         for layer, delta, O in zip(self, deltas, Os):
-            for i, neuron in enumerate(layer):
-                for j, weight in enumerate(neuron):
-                    layer[i][j] -= rate * O[j] * delta[i]
-        return sum(Os[-1])
+            layer -= (rate / n) * numpy.dot(numpy.atleast_2d(delta).T, numpy.atleast_2d(O))
+        return (Ds[-1] ** 2).sum() / 2.
 
     def score(self, X):
-        return self.forward(X)[1][-1][:-1]
+        return self.forward(X)[1][-1][..., :-1]
+
+    def epoch(self, X, T, batch=32, **kwds):
+        """Learn from the rows of `X` and `T`, a mini-batch at a time, and return the total error."""
+        return sum(self.learn(X[i:i + batch], T[i:i + batch], **kwds) for i in xrange(0, len(X), batch))
 
     def train(self, data, tol=1e-3, **kwds):
         while sum(self.learn(X, T, **kwds) for X, T in data) > tol:
             pass
 
+    def fit(self, source, size=10000, batch=32, rate=.05, validation=None, holdout=.1,
+            epochs=100, patience=5, tol=0., seed=None, hook=None):
+        """
+        Learn from the `source`, (X, T) arrays or a function returning (X, T) chunks, in shuffled buffers of `size` rows,
+        until the validation error has not improved by `tol` for `patience` epochs, or for at most `epochs`.
+
+        The validation rows are the `validation` pair, or else the first `holdout` of the arrays (or buffer of the chunks).
+        The weights of the best epoch are kept, and the `Epoch` of each returned;
+        if `hook` is given, it is called with each as it comes, and can stop training by returning False.
+        """
+        stream = chunks(source, size)
+        if validation is None:
+            held = size if callable(source) else int(holdout * len(source[0]))
+            validation = next(buffers(rows(stream(), 0, held), held), None) if held else None
+        else:
+            held = 0
+        if validation is None or not len(validation[0]):
+            raise ValueError("nothing to hold out for validation (give more rows, a larger holdout, or a validation pair)")
+        Xv, Tv = validation
+        random = numpy.random.RandomState(seed)
+        best, wait, history = float('inf'), 0, []
+        weights = [layer.copy() for layer in self]
+        for n in xrange(epochs):
+            start = time.time()
+            error = samples = 0
+            for X, T in buffers(rows(stream(), held), size):
+                order = random.permutation(len(X))
+                error += self.epoch(X[order], T[order], batch, rate=rate)
+                samples += len(X)
+            seconds = time.time() - start
+            score = ((self.score(Xv) - Tv) ** 2).sum() / 2. / len(Xv)
+            history.append(Epoch(n, error, score, samples, seconds, samples / seconds if seconds else float('inf')))
+            if score < best - tol:
+                best, wait = score, 0
+                weights = [layer.copy() for layer in self]
+            else:
+                wait += 1
+            if (hook is not None and hook(history[-1]) is False) or wait >= patience:
+                break
+        for layer, W in zip(self, weights):
+            layer[:] = W
+        return history
+
+def chunks(source, size):
+    """A function returning the (X, T) chunks of the `source`: (X, T) arrays, read `size` rows at a time, or such a function."""
+    if callable(source):
+        return source
+    X, T = source
+    return lambda: ((X[i:i + size], T[i:i + size]) for i in xrange(0, len(X), size))
+
+def rows(chunks, start=0, stop=None):
+    """The parts of the (X, T) `chunks` from row `start` to `stop`."""
+    n = 0
+    for X, T in chunks:
+        lo, hi = max(start - n, 0), len(X) if stop is None else min(stop - n, len(X))
+        if lo < hi:
+            yield X[lo:hi], T[lo:hi]
+        n += len(X)
+        if stop is not None and n >= stop:
+            break
+
+def buffers(chunks, size):
+    """The (X, T) `chunks`, gathered into (in memory) arrays of `size` rows (but the last)."""
+    Xs, Ts, n = [], [], 0
+    for X, T in chunks:
+        while len(X):
+            m = min(size - n, len(X))
+            Xs.append(X[:m])
+            Ts.append(T[:m])
+            X, T, n = X[m:], T[m:], n + m
+            if n == size:
+                yield numpy.concatenate(Xs), numpy.concatenate(Ts)
+                Xs, Ts, n = [], [], 0
+    if n:
+        yield numpy.concatenate(Xs), numpy.concatenate(Ts)
+
 if __name__ == '__main__':
     xor = [([0,0], [-1]), ([0,1], [1]), ([1,0], [1]), ([1,1], [-1])]
     net = network(2, 2, 1)
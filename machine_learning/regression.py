@@ -1,20 +1,83 @@
-from math import exp
-from numpy import array, ones, zeros
+"""
+Logistic regression, of labels y in {0, 1}: gradient ascent on the log-likelihood,
+in mini-batches of the rows of X, or Newton's method.
+
+X may be an array, or a scipy.sparse matrix (the design matrices of `logs` have a row per feature,
+so take their transpose):
+
+>>> from scipy.sparse import csr_matrix
+>>> random = numpy.random.RandomState(0)
+>>> X = numpy.hstack([random.randn(2000, 3), numpy.ones((2000, 1))])
+>>> y = (random.rand(2000) < logistic(X.dot([2., -1., 0., .5]))).astype(float)
+>>> theta = gl_regression(X, y, method='newton')
+>>> numpy.round(theta, 2)
+array([ 1.99, -0.98,  0.  ,  0.57])
+>>> abs(gl_regression(csr_matrix(X), y, method='newton') - theta).max() < 1e-10
+True
+>>> abs(gl_regression(X, y, batch=100, rate=decaying(1., .5), seed=0) - theta).max() < .05
+True
+>>> ridge = gl_regression(X, y, method='newton', l2=.01)
+>>> abs(gl_regression(X, y, batch=100, rate=decaying(1., .5), l2=.01, seed=0) - ridge).max() < 1e-3
+True
+>>> numpy.round(gl_regression(X, y, batch=100, rate=decaying(1., .5), l1=.01, seed=0), 2)
+array([ 1.76, -0.84,  0.  ,  0.46])
+>>> Logistic(theta)(X[:2])
+array([0.97559507, 0.96024443])
+"""
+import numpy
+from scipy.sparse import issparse
+from scipy.special import expit
 
 class Logistic(object):
     def __init__(self, theta):
         self.theta = theta
 
-    def __call__(self, x):
-        return 1. / (1. + exp(theta.dot(x)))
+    def __call__(self, X):
+        return logistic(X.dot(self.theta))
+
+def logistic(z, out=None):
+    """The logistic function, computed stably (without overflow) for any z."""
+    return expit(z, out=out) if out is not None else expit(z)
+
+def decaying(rate=1., power=1.):
+    """The learning rate schedule rate / k ** power, for the k-th sweep."""
+    return lambda k: rate / k ** power
 
-def logistic(z):
-    return 1. / (1. + exp(-z))
+def gl_regression(X, y, h=logistic, N=10000, batch=1, rate=decaying(), l1=0., l2=0., tol=1e-6,
+                  method='sgd', seed=None):
+    """
+    Fit theta, maximizing the mean log-likelihood (over the rows of X) less l1 |theta|_1 + l2 / 2 ||theta||^2,
+    by at most `N` sweeps,
+    stopping once a sweep changes no coefficient by more than `tol` (relative to the largest).
 
-def gl_regression(X, y, h=logistic, N=10000):
-    theta = zeros(len(X[0]))
+    With `method` 'sgd', each sweep takes steps on the mean gradient of each `batch` of rows (shuffled, given a `seed`),
+    of size `rate(k)` in sweep k (or a constant `rate`), and the l1 penalty by soft thresholding;
+    with 'newton', each is a Newton step (on the whole of X, and for the logistic `h` only).
+    """
+    X = X.tocsr() if issparse(X) else numpy.asarray(X, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    M, n = X.shape
+    theta = numpy.zeros(n)
+    step = rate if callable(rate) else lambda k: rate
+    random = numpy.random.RandomState(seed) if seed is not None else None
     for k in xrange(1, N):
-        for i, x in enumerate(X):
-            theta = array([theta[j] + (1. / k) * (y[i] - h(theta.dot(x))) * x_
-                           for j, x_ in enumerate(x)])
+        theta_ = theta.copy()
+        if method == 'newton':
+            if l1:
+                raise ValueError("Newton's method needs a smooth penalty (l1=0)")
+            p = logistic(X.dot(theta))
+            H = X.T.dot(X.multiply((p * (1 - p))[:, None]) if issparse(X) else X * (p * (1 - p))[:, None])
+            H = H.toarray() if issparse(H) else H
+            theta += numpy.linalg.solve(H / M + l2 * numpy.eye(n), X.T.dot(y - p) / M - l2 * theta)
+        else:
+            eta = step(k)
+            order = random.permutation(M) if random else numpy.arange(M)
+            for i in xrange(0, M, batch):
+                rows = order[i:i + batch]
+                Xb = X[rows]
+                theta += eta * (Xb.T.dot(y[rows] - h(Xb.dot(theta))) / len(rows) - l2 * theta)
+                if l1:
+                    theta = numpy.sign(theta) * numpy.maximum(abs(theta) - eta * l1, 0)
+        if abs(theta - theta_).max() <= tol * max(abs(theta).max(), 1):
+            break
     return theta
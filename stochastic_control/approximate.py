@@ -0,0 +1,134 @@
+"""
+Approximate dynamic programming, for Markov Decision Problems whose states are too many to enumerate.
+
+Rather than backing up every state of X(t), we back up a sample of them (using the problem's own
+U, W, step and cost), and fit a value function to the results: linear in features of the state,
+or the average of the nearest sampled states. Only the fitted value functions are kept,
+so the memory is bounded by the sample size, and the policy is found when it is asked for,
+by looking one step ahead.
+
+Inventory, from `decision`, sampling its states (so the nearest neighbor is exact):
+
+>>> import decision
+>>> inf = float('inf')
+>>> T = 50
+>>> C = 6
+>>> mdp = decision.MDP(T, lambda t: range(C + 1), W=lambda t, x, u: {0: .7, 1: .2, 2: .1})
+>>> mdp.step = lambda t, x, u, d: x - d + u
+>>> mdp.cost = lambda t, x, u, d: .1 * x + 1 * (u > 0) if 0 <= x - d + u <= C else inf
+>>> mu = dict(mdp.policy())
+>>> sample = lambda t, random, N: random.randint(0, C + 1, size=N).tolist()
+>>> nu = fit(mdp, sample, Nearest(lambda x: [x], k=1), N=100, seed=0)
+>>> all(nu[t][x] == mu[t][x] for t in mu for x in mu[t])
+True
+
+Or with values quadratic in the stock, which gets the same actions most of the time:
+
+>>> nu = fit(mdp, sample, Linear(lambda x: [1, x, x * x]), N=100, seed=0)
+>>> sum(nu[t][x][1] == mu[t][x][1] for t in mu for x in mu[t]) > .9 * T * (C + 1)
+True
+"""
+import numpy
+
+class Linear(object):
+    """Values linear in the `features(x)` of each state (a sequence of floats), fit by (ridge) least squares."""
+    def __init__(self, features, ridge=0.):
+        self.features = features
+        self.ridge = ridge
+
+    def matrix(self, xs):
+        return numpy.array([self.features(x) for x in xs], dtype=float)
+
+    def fit(self, xs, vs):
+        F = self.matrix(xs)
+        w = numpy.linalg.lstsq(F.T.dot(F) + self.ridge * numpy.eye(F.shape[1]), F.T.dot(vs), rcond=None)[0]
+        return lambda xs: self.matrix(xs).dot(w)
+
+class Nearest(object):
+    """Values averaged over the `k` sampled states nearest (in the `coords(x)` of each state) to the state."""
+    def __init__(self, coords, k=5, chunk=1024):
+        self.coords = coords
+        self.k = k
+        self.chunk = chunk
+
+    def matrix(self, xs):
+        return numpy.array([self.coords(x) for x in xs], dtype=float)
+
+    def fit(self, xs, vs):
+        C, vs = self.matrix(xs), numpy.asarray(vs, dtype=float)
+        k = min(self.k, len(vs))
+        def value(xs):
+            Q = self.matrix(xs)
+            v = numpy.empty(len(Q))
+            for i in xrange(0, len(Q), self.chunk):
+                D = ((Q[i:i + self.chunk, None, :] - C[None, :, :]) ** 2).sum(axis=2)
+                near = numpy.argpartition(D, k - 1, axis=1)[:, :k]
+                v[i:i + self.chunk] = vs[near].mean(axis=1)
+            return v
+        return value
+
+def lookahead(mdp, t, xs, V):
+    """
+    Return the best (value, action) of each state in `xs` at time t, given the value function `V` at t + 1.
+
+    The successors of all the states are valued at once, by a single call to `V` (or none, if it is None).
+    """
+    entries, ys = [], []
+    for i, x in enumerate(xs):
+        for u in mdp.U(t, x):
+            for w, p in mdp.W(t, x, u).items():
+                entries.append((i, u, mdp.cost(t, x, u, w), p))
+                ys.append(mdp.step(t, x, u, w))
+    vs = V(ys).tolist() if V is not None and ys else [0] * len(ys)
+    E = {}
+    for (i, u, g, p), v in zip(entries, vs):
+        E[i, u] = E.get((i, u), 0) + (g + v) * p
+    best = [None] * len(xs)
+    for (i, u), e in E.items():
+        if best[i] is None or (e, u) < best[i]:
+            best[i] = e, u
+    return best
+
+def fit(mdp, sample, model, N=1000, seed=None):
+    """
+    Fit a value function to each stage of `mdp`, backwards in time, and return the `Approximate` policy.
+
+    At each t, `sample(t, random, N)` gives `N` states (using `random`, a RandomState),
+    whose values are looked ahead to the value function fit at t + 1, and then fit by `model`.
+    States with infinite values are left out of the fit.
+    """
+    random = numpy.random.RandomState(seed)
+    values = {mdp.T: None}
+    for t in reversed(xrange(mdp.T)):
+        xs = sample(t, random, N)
+        vs = numpy.array([v for v, u in lookahead(mdp, t, xs, values[t + 1])], dtype=float)
+        finite = numpy.isfinite(vs)
+        values[t] = model.fit([x for x, f in zip(xs, finite) if f], vs[finite])
+    return Approximate(mdp, values)
+
+class Approximate(object):
+    """
+    A policy found by looking one step ahead to fitted `values` (a function of a list of states, for each t).
+
+    Like the stage dicts of `decision.MDP.policy`, `policy[t][x]` gives the (value, action) of x at t.
+    """
+    def __init__(self, mdp, values):
+        self.mdp = mdp
+        self.values = values
+
+    def __getitem__(self, t):
+        return ApproximateStage(self, t)
+
+    def __len__(self):
+        return self.mdp.T
+
+    def lookahead(self, t, xs):
+        return lookahead(self.mdp, t, xs, self.values.get(t + 1))
+
+class ApproximateStage(object):
+    def __init__(self, policy, t):
+        self.policy = policy
+        self.t = t
+
+    def __getitem__(self, x):
+        return self.policy.lookahead(self.t, [x])[0]
@@ -15,7 +15,27 @@ The example from `http://www.stanford.edu/class/ee365/lectures/det_sys`
          3: {'a': (inf, 'a'), 'b': (inf, 'a'), 'c': (inf, 'a'), 'd': (0, 'a')}}
 >>> p == P
 True
+
+Watching each stage (stopping after the second):
+
+>>> import instrument
+>>> recorder = instrument.Recorder(limit=2)
+>>> dict(policy(T=4, X=lambda t: nodes, U=lambda t, x: nodes, f=step, g=cost, hook=recorder)) == {3: P[3], 2: P[2]}
+True
+>>> [(s.t, sorted(s.calls.items()), s.pairs) for s in recorder.stats]
+[(3, [('f', 16), ('g', 16)], 16), (2, [('f', 16), ('g', 16)], 16)]
+
+The same, as shortest paths over an explicit list of (feasible) edges:
+
+>>> arcs = [(x, u, c) for (x, u), c in edges.items()]
+>>> final = [('d', u, 0) for u in nodes]
+>>> dict(graph(T=4, nodes=nodes, edges=lambda t: arcs if t < 3 else final)) == P
+True
 """
+import numpy
+import instrument
+
+inf = float('inf')
 
 def step(t, x, u, T=None):
     """Return the state at time t + 1."""
@@ -23,8 +43,78 @@ def step(t, x, u, T=None):
 def cost(t, x, u, T=None):
     """Return a real or infinite value."""
 
-def policy(T, X, U, f=step, g=cost, p={}):
+def policy(T, X, U, f=step, g=cost, p={}, hook=None):
+    if hook is not None:
+        calls = {}
+        f, g = instrument.Counter(f, 'f', calls), instrument.Counter(g, 'g', calls)
+        pairs = lambda t, p: sum(1 for x in p for u in U(t, x))
+        for t, p in instrument.stages(policy(T, X, U, f, g, p), hook, calls, pairs):
+            yield t, p
+        return
     V = lambda x: p.get(x, (0, None))[0]
     for t in reversed(xrange(T)):
         p = dict((x, min((g(t, x, u, T) + V(f(t, x, u, T)), u) for u in U(t, x))) for x in X(t))
         yield t, p
+
+def graph(T, nodes, edges, p={}):
+    """
+    Like `policy`, for deterministic problems given as sparse graphs.
+
+    `edges(t)` returns the (x, y, cost) edges available at time t (moving from x to y, for cost),
+    or `edges` is a single list of them, for all t. Each distinct list is compiled once into arrays,
+    dropping any infeasible (infinite cost) edges.
+
+    Edges are kept sorted by source, so each stage is a segmented minimum over them,
+    and a label-correcting pass: only the nodes with an edge into a node whose cost-to-go changed
+    are relaxed again (the rest keep their labels, and if none change, the stage is reused).
+    Ties go to the least successor, and nodes without a feasible edge get (inf, min(nodes)),
+    just as `policy` would give for U(t, x) = nodes.
+    """
+    nodes = sorted(nodes)
+    S = len(nodes)
+    targets = list(nodes)
+    index = dict((x, i) for i, x in enumerate(nodes))
+    compiled = {}
+    def compile(E):
+        if id(E) not in compiled:
+            arcs = [(index[x], target(y), c) for x, y, c in E if c < inf]
+            src, dst, cost = (numpy.array(a) for a in zip(*arcs)) if arcs else (numpy.zeros(0),) * 3
+            order = numpy.lexsort((dst, src))
+            compiled[id(E)] = E, (src[order].astype(int), dst[order].astype(int), cost[order].astype(float))
+        return compiled[id(E)][1]
+    def target(y):
+        if y not in index:
+            index[y] = len(targets)
+            targets.append(y)
+        return index[y]
+    source = edges if callable(edges) else lambda t: edges
+    last = changed = None
+    for t in reversed(xrange(T)):
+        E = source(t)
+        src, dst, cost = compile(E)
+        V = numpy.array([p.get(y, (0, None))[0] for y in targets], dtype=float) if last is None else V_
+        V = numpy.concatenate((V, numpy.zeros(len(targets) - len(V))))
+        if last is E:
+            stale = numpy.zeros(S, dtype=bool)
+            stale[src[changed[dst]]] = True
+        else:
+            value, succ = numpy.empty(S), numpy.empty(S, dtype=int)
+            stale = numpy.ones(S, dtype=bool)
+        if stale.any():
+            value[stale], succ[stale] = inf, 0
+            live = stale[src]
+            s, d, c = src[live], dst[live], cost[live] + V[dst[live]]
+            if len(s):
+                new = numpy.concatenate(([True], s[1:] != s[:-1]))
+                starts = numpy.flatnonzero(new)
+                low = numpy.minimum.reduceat(c, starts)
+                at = numpy.where(c == low[numpy.cumsum(new) - 1], numpy.arange(len(c)), len(c))
+                first = numpy.minimum.reduceat(at, starts)[low < inf]
+                value[s[first]], succ[s[first]] = c[first], d[first]
+            i = numpy.flatnonzero(stale).tolist()
+            p = {} if last is not E else p.copy()
+            p.update(zip([nodes[j] for j in i], zip(value[i].tolist(), [targets[j] for j in succ[i].tolist()])))
+        V_ = numpy.concatenate((value, numpy.zeros(len(targets) - S)))
+        changed = V_ != V
+        last = E
+        yield t, p
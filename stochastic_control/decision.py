@@ -15,7 +15,197 @@ Our old friend, inventory:
 >>> mu = dict(mdp.policy())
 >>> [t for t, p in mu.items() if [u for x, (v, u) in p.items()] == [4, 3, 0, 0, 0, 0, 0]] == range(T - 2)
 True
+
+The same backups, compiled into arrays once per regime:
+
+>>> dict(mdp.policy(compiled=True)) == mu
+True
+>>> mdp.regime = lambda t: None
+>>> dict(mdp.policy(compiled=True)) == mu
+True
+
+Once the backups become stationary, earlier stages can reuse them:
+
+>>> nu = dict(mdp.policy(compiled=True, tol=1e-6))
+>>> all(nu[t][x][1] == mu[t][x][1] and abs(nu[t][x][0] - mu[t][x][0]) < 1e-4 for t in mu for x in mu[t])
+True
+
+A change of regime starts afresh, even if an earlier regime comes back:
+
+>>> B = lambda t: 10 <= t < 12
+>>> alt = MDP(30, lambda t: range(3), U=lambda t, x: range(3), W=lambda t, x, u: {0: 1.})
+>>> alt.step = lambda t, x, u, d: u
+>>> alt.cost = lambda t, x, u, d: ([5, 0, 1] if B(t) else [1, 2, 3])[x] + .5 * (u != x)
+>>> alt.regime = B
+>>> exact = dict(alt.policy())
+>>> [dict(alt.policy(compiled=c, tol=1e-9)) == exact for c in (False, True)]
+[True, True]
+
+States whose values stop changing count too (so this is never stationary):
+
+>>> still = MDP(20, lambda t: range(3), U=lambda t, x: [0], W=lambda t, x, u: {0: 1.})
+>>> still.step = lambda t, x, u, d: x
+>>> still.cost = lambda t, x, u, d: 0 if x == 0 else 1
+>>> still.regime = lambda t: None
+>>> [sorted(dict(still.policy(compiled=c, tol=1e-6))[0].items()) for c in (False, True)]
+[[(0, (0.0, 0)), (1, (20.0, 0)), (2, (20.0, 0))], [(0, (0.0, 0)), (1, (20.0, 0)), (2, (20.0, 0))]]
+
+Over an infinite horizon, the same policy is optimal (except when the stock is low):
+
+>>> [u for x, (v, u) in sorted(mdp.value_iteration(gamma=.9).items())]
+[4, 3, 0, 0, 0, 0, 0]
+>>> vi = mdp.value_iteration(gamma=.9, tol=1e-9)
+>>> close = lambda p: all(abs(vi[x][0] - p[x][0]) < 1e-6 and vi[x][1] == p[x][1] for x in vi)
+>>> close(mdp.policy_iteration(gamma=.9)), close(mdp.modified_policy_iteration(gamma=.9, tol=1e-9))
+(True, True)
+>>> mdp.value_iteration(gamma=1.)
+Traceback (most recent call last):
+    ...
+ValueError: the discount factor must be in [0, 1): 1.0
+
+Several costs can share the same dynamics, and be solved at once:
+
+>>> costs = [lambda t, x, u, d, K=K: .1 * x + K * (u > 0) if 0 <= x - d + u <= C else inf for K in (.5, 1, 2)]
+>>> sweep = dict(mdp.sweep(costs))
+>>> sweep[0][1] == dict(mdp.policy())[0]
+True
+>>> [[u for x, (v, u) in sorted(p.items())] for p in sweep[0]]
+[[2, 1, 0, 0, 0, 0, 0], [4, 3, 0, 0, 0, 0, 0], [5, 4, 0, 0, 0, 0, 0]]
+
+Or, with the states of each stage split across processes:
+
+>>> dict(mdp.policy(processes=2)) == mu
+True
+
+The average cost per stage is the eventual increase in cost-to-go per stage:
+
+>>> g, h = mdp.relative_value_iteration()
+>>> abs(g - (mu[0][0][0] - mu[1][0][0])) < 1e-6
+True
 """
+import bisect
+import itertools
+import multiprocessing
+import numpy
+import instrument
+
+inf = float('inf')
+
+class Stage(object):
+    """
+    The transitions and costs of a single stage, enumerated once into arrays.
+
+    `succ`, `cost` and `prob` are indexed by (state, action, disturbance),
+    where actions are sorted per state and padding is masked out by `mask`.
+    Successors index into `targets`, which begins with `states`.
+
+    Given several `costs` (with the signature of `mdp.cost`), the stage holds all of them,
+    along a last axis of `cost`: target values and results then have a column per cost.
+    """
+    def __init__(self, mdp, t, costs=None):
+        self.states = states = list(mdp.X(t))
+        self.actions = actions = [sorted(mdp.U(t, x)) for x in states]
+        self.targets = targets = list(states)
+        index = dict((x, i) for i, x in enumerate(states))
+        def target(y):
+            if y not in index:
+                index[y] = len(targets)
+                targets.append(y)
+            return index[y]
+        S = len(states)
+        A = max(len(us) for us in actions)
+        cost = mdp.cost if costs is None else lambda t, x, u, w: [c(t, x, u, w) for c in costs]
+        entries = [(i, j, k, target(mdp.step(t, x, u, w)), cost(t, x, u, w), p)
+                   for i, (x, us) in enumerate(zip(states, actions))
+                   for j, u in enumerate(us)
+                   for k, (w, p) in enumerate(mdp.W(t, x, u).items())]
+        K = max(e[2] for e in entries) + 1 if entries else 1
+        i, j, k, y, c, p = zip(*entries) if entries else ((),) * 6
+        self.succ = numpy.zeros((S, A, K), dtype=int)
+        self.cost = numpy.zeros((S, A, K) + (() if costs is None else (len(costs),)))
+        self.prob = numpy.zeros((S, A, K))
+        self.mask = numpy.zeros((S, A, K), dtype=bool)
+        self.succ[i, j, k] = y
+        self.cost[i, j, k] = c
+        self.prob[i, j, k] = p
+        self.mask[i, j, k] = True
+        self.valid = numpy.arange(A) < numpy.array([len(us) for us in actions])[:, None]
+
+    @classmethod
+    def build(cls, states, actions, targets, succ, cost, prob, mask):
+        """Return a stage from arrays built directly (as by the `tabulate` of an MDP that can)."""
+        stage = cls.__new__(cls)
+        stage.states = states
+        stage.actions = actions
+        stage.targets = targets
+        stage.succ = succ
+        stage.cost = cost
+        stage.prob = prob
+        stage.mask = mask
+        stage.valid = numpy.arange(succ.shape[1]) < numpy.array([len(us) for us in actions])[:, None]
+        return stage
+
+    def expect(self, v, rows=slice(None)):
+        """Return the expected cost-to-go of each (state, action) given the target values `v`."""
+        B = self.cost.shape[3:]
+        wide = lambda a: a.reshape(a.shape + (1,) * len(B))
+        valid = self.valid[rows]
+        q = numpy.zeros(valid.shape + B)
+        with numpy.errstate(invalid='ignore'):
+            for k in xrange(self.mask.shape[2]):
+                m = wide(self.mask[rows, :, k])
+                q += numpy.where(m, (self.cost[rows, :, k] + v[self.succ[rows, :, k]]) * wide(self.prob[rows, :, k]), 0)
+        q[~valid] = inf
+        return q
+
+    def backup(self, v, rows=slice(None)):
+        """Return the optimal values and action indices (of the `rows` states) given the target values `v`."""
+        q = self.expect(v, rows)
+        a = q.argmin(axis=1)
+        return numpy.take_along_axis(q, a[:, None], axis=1)[:, 0], a
+
+    def follow(self, a, v):
+        """Return the expected cost-to-go of each state under action indices `a`, given target values `v`."""
+        return self.expect(v)[numpy.arange(len(a)), a]
+
+    def improve(self, v, a):
+        """Return the greedy action indices given target values `v`, keeping those of `a` on ties."""
+        q = self.expect(v)
+        a_ = q.argmin(axis=1)
+        i = numpy.arange(len(a))
+        return numpy.where(q[i, a] <= q[i, a_], a, a_)
+
+    def evaluate(self, a, gamma=1.):
+        """Return the discounted values of following action indices `a` forever."""
+        S = len(self.states)
+        i = numpy.arange(S)
+        m = self.mask[i, a]
+        c = numpy.where(m, self.cost[i, a] * self.prob[i, a], 0).sum(axis=1)
+        P = numpy.zeros((S, len(self.targets)))
+        numpy.add.at(P, (numpy.repeat(i, m.shape[1])[m.ravel()], self.succ[i, a][m]), self.prob[i, a][m])
+        return numpy.linalg.solve(numpy.eye(S) - gamma * P[:, :S], c)
+
+    def values(self, p):
+        """Return the target values of a stage policy dict `p` (or the columns of a list of them)."""
+        if isinstance(p, list):
+            return numpy.column_stack([self.values(q) for q in p])
+        return numpy.array([p.get(x, (0, None))[0] for x in self.targets], dtype=float)
+
+    def extend(self, v):
+        """Return the target values of this stage's own state values `v`."""
+        return numpy.concatenate((v, numpy.zeros((len(self.targets) - len(v),) + v.shape[1:])))
+
+    def indices(self, p):
+        """Return the action indices of the actions chosen by a stage policy `p`."""
+        return numpy.array([us.index(p[x][1]) for x, us in zip(self.states, self.actions)], dtype=int)
+
+    def choose(self, a):
+        return [us[j] for us, j in zip(self.actions, a.tolist())]
+
+    def policy(self, v, a):
+        if v.ndim > 1:
+            return [self.policy(v[:, b], a[:, b]) for b in xrange(v.shape[1])]
+        return dict(zip(self.states, zip(v.tolist(), self.choose(a))))
 
 class MDP(object):
     def __init__(self, T, X, U=None, W=None):
@@ -30,11 +220,295 @@ class MDP(object):
     def cost(self, t, x, u, w):
         """Return a real or infinite stage cost."""
 
-    def policy(self, p={}):
+    def regime(self, t):
+        """Return a key shared by all stages with the same X, U, W, step and cost."""
+        return t
+
+    def convex(self, t):
+        """Return True if, at time t, the expected cost-to-go of every state is convex (and finite) in its sorted actions."""
+        return False
+
+    def neighbor(self, t, x):
+        """
+        Return a state y preceding x in X(t), and a sign, such that the optimal action at x is
+        no less (sign > 0) or no greater (sign < 0) than at y, or else None.
+        """
+
+    def backup(self, t, p):
+        """
+        Return the optimal (value, action) of each state at time t, given those at t + 1.
+
+        When the actions are `convex`, each state finds its optimal action by bisection,
+        and when a state has a `neighbor`, its actions are cut off at the neighbor's optimal action.
+        """
         f = self.step
         g = self.cost
-        E = lambda t, x, u, W: sum((g(t, x, u, w) + V(t, f(t, x, u, w))) * p for w, p in W.items())
-        V = lambda t, x: p.get(x, (0, None))[0]
+        E = lambda x, u, W: sum((g(t, x, u, w) + V(f(t, x, u, w))) * q for w, q in W.items())
+        V = lambda x: p.get(x, (0, None))[0]
+        convex = self.convex(t)
+        p_ = {}
+        for x in self.X(t):
+            us = self.U(t, x)
+            hint = self.neighbor(t, x)
+            if hint and hint[0] in p_:
+                us, b = sorted(us), p_[hint[0]][1]
+                us = us[bisect.bisect_left(us, b):] if hint[1] > 0 else us[:bisect.bisect_right(us, b)]
+            if convex:
+                p_[x] = bisection(lambda u: E(x, u, self.W(t, x, u)), sorted(us))
+            else:
+                p_[x] = min((E(x, u, self.W(t, x, u)), u) for u in us)
+        return p_
+
+    def tabulate(self, t, costs=None):
+        """Return the `Stage` at time t (subclasses that can build its arrays directly may override)."""
+        return Stage(self, t, costs)
+
+    def stages(self, costs=None):
+        """Return a function giving the `Stage` at time t, compiling each regime once."""
+        cache = {}
+        def stage(t):
+            key = self.regime(t)
+            if key not in cache:
+                cache[key] = self.tabulate(t, costs)
+            return cache[key]
+        return stage
+
+    def compiled(self, costs=None):
+        """Return a backup like `backup`, compiling each regime into a `Stage` once."""
+        stages, last = self.stages(costs), [None, None, None]
+        def backup(t, p):
+            stage = stages(t)
+            if last[0] is stage and last[1] is p:
+                v, a = stage.backup(stage.extend(last[2]))
+            else:
+                v, a = stage.backup(stage.values(p))
+            last[:] = stage, stage.policy(v, a), v
+            return last[1]
+        return backup
+
+    def policy(self, p={}, compiled=False, tol=None, processes=None, hook=None):
+        """
+        Yield the optimal (value, action) of each state for t = T - 1, ..., 0.
+
+        If `processes` is given, the backups are compiled and split across that many processes
+        (or one per cpu, if 0), see `Shards`.
+
+        If `tol` is given, once two consecutive stages of the same regime choose the same actions,
+        with values that differ by a constant (to within `tol`), the backup has become stationary:
+        earlier stages of that regime reuse its policy, shifting the values by the constant.
+
+        If `hook` is given, it is called with the `instrument.Stats` of each stage, and can stop the solve.
+        """
+        if hook is not None:
+            with instrument.counting(self, ('step', 'cost', 'W')) as calls:
+                pairs = lambda t, p: sum(len(self.U(t, x)) for x in p)
+                for t, p in instrument.stages(self.policy(p, compiled, tol, processes), hook, calls, pairs):
+                    yield t, p
+            return
+        if processes is not None:
+            backup = Shards(self, processes or None)
+        else:
+            backup = self.compiled() if compiled else self.backup
+        regime = drift = None
+        try:
+            for t in reversed(xrange(self.T)):
+                key = self.regime(t)
+                if drift is not None and key == regime:
+                    p = dict((x, (v + drift, u)) for x, (v, u) in p.items()) if drift else p
+                else:
+                    p_, p = p, backup(t, p)
+                    drift = stationary(p, p_, tol) if tol is not None and t < self.T - 1 and key == regime else None
+                regime = key
+                yield t, p
+        finally:
+            if processes is not None:
+                backup.close()
+
+    def sweep(self, costs, p=None):
+        """
+        Yield the optimal (value, action) of each state for t = T - 1, ..., 0, for several costs at once.
+
+        Each of the `costs` replaces `cost`, sharing X, U, W and step, which are enumerated only once.
+        Each stage is a list of policy dicts, one per cost, just as `policy` would give for that cost.
+        """
+        backup = self.compiled(costs)
+        p = [{}] * len(costs) if p is None else p
         for t in reversed(xrange(self.T)):
-            p = dict((x, min((E(t, x, u, self.W(t, x, u)), u) for u in self.U(t, x))) for x in self.X(t))
+            p = backup(t, p)
             yield t, p
+
+    def infinite(self, t=0):
+        """Return the compiled stage at time t, for use as a stationary (infinite horizon) problem."""
+        return self.tabulate(t)
+
+    def value_iteration(self, gamma, tol=1e-6, t=0, limit=10000):
+        """
+        Solve the discounted (0 <= gamma < 1) infinite horizon problem, by value iteration from zero.
+
+        Stops once successive value functions are within `tol` (in the max norm), or after `limit` sweeps.
+        Successors outside of X(t) are worth nothing.
+        """
+        discount(gamma)
+        stage = self.infinite(t)
+        v = numpy.zeros(len(stage.states))
+        for n in irange(limit):
+            v_, a = stage.backup(gamma * stage.extend(v))
+            if distance(v_, v) <= tol:
+                break
+            v = v_
+        return stage.policy(v_, a)
+
+    def policy_iteration(self, gamma, t=0, a=None, limit=None):
+        """
+        Solve the discounted (0 <= gamma < 1) infinite horizon problem, by policy iteration.
+
+        Each policy is evaluated exactly, by solving the linear equations it induces.
+        Unless given, the initial action indices `a` are greedy with respect to zero values.
+        """
+        discount(gamma)
+        stage = self.infinite(t)
+        a = stage.backup(numpy.zeros(len(stage.targets)))[1] if a is None else a
+        for n in irange(limit):
+            v = stage.evaluate(a, gamma)
+            a_ = stage.improve(gamma * stage.extend(v), a)
+            if (a_ == a).all():
+                break
+            a = a_
+        return stage.policy(v, a)
+
+    def modified_policy_iteration(self, gamma, m=20, tol=1e-6, t=0, limit=10000):
+        """
+        Solve the discounted (0 <= gamma < 1) infinite horizon problem, by modified policy iteration.
+
+        Each policy is evaluated approximately, by `m` sweeps of its own backup.
+        Stops once the Bellman residual is within `tol` (in the max norm), or after `limit` improvements.
+        """
+        discount(gamma)
+        stage = self.infinite(t)
+        v = numpy.zeros(len(stage.states))
+        for n in irange(limit):
+            v_, a = stage.backup(gamma * stage.extend(v))
+            if distance(v_, v) <= tol:
+                break
+            v = v_
+            for k in xrange(m):
+                v = stage.follow(a, gamma * stage.extend(v))
+        return stage.policy(v_, a)
+
+    def relative_value_iteration(self, tol=1e-6, t=0, ref=0, limit=10000):
+        """
+        Solve the average cost infinite horizon problem, by relative value iteration.
+
+        Returns the optimal average cost per stage, and the relative values,
+        normalized so that state `ref` (an index into X(t)) is worth nothing.
+        Stops once the span of the change in values is within `tol`, or after `limit` sweeps.
+        """
+        stage = self.infinite(t)
+        h = numpy.zeros(len(stage.states))
+        for n in irange(limit):
+            v, a = stage.backup(stage.extend(h))
+            if span(v - h) <= tol:
+                break
+            h = v - v[ref]
+        return v[ref] - h[ref], stage.policy(v - v[ref], a)
+
+class Shards(object):
+    """
+    A compiled backup, with the states of each stage split into slices across a pool of processes.
+
+    Every regime is compiled before the workers fork, so they share the stages (copy-on-write).
+    The values pass through shared memory: the workers read the target values of each stage
+    and write their slice of its values and action indices, so only the slice bounds are pickled.
+    The buffers are global, so only one set of shards can be open at a time.
+    """
+    def __init__(self, mdp, processes=None):
+        stages = mdp.stages()
+        self.stages = dict((t, stages(t)) for t in xrange(mdp.T))
+        self.processes = processes or multiprocessing.cpu_count()
+        S = max(len(stage.states) for stage in self.stages.values())
+        N = max(len(stage.targets) for stage in self.stages.values())
+        shards.update(stages=self.stages,
+                      v=numpy.frombuffer(multiprocessing.RawArray('d', N)),
+                      values=numpy.frombuffer(multiprocessing.RawArray('d', S)),
+                      actions=numpy.frombuffer(multiprocessing.RawArray('l', S), dtype=numpy.int_))
+        self.pool = multiprocessing.Pool(self.processes)
+        self.last = None, None, None
+
+    def __call__(self, t, p):
+        stage = self.stages[t]
+        last, p_, v_ = self.last
+        v = stage.extend(v_) if last is stage and p_ is p else stage.values(p)
+        shards['v'][:len(v)] = v
+        S = len(stage.states)
+        cuts = numpy.linspace(0, S, self.processes + 1).astype(int)
+        self.pool.map(shard, [(t, lo, hi) for lo, hi in zip(cuts[:-1], cuts[1:]) if lo < hi])
+        v, a = shards['values'][:S].copy(), shards['actions'][:S].copy()
+        p = stage.policy(v, a)
+        self.last = stage, p, v
+        return p
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        shards.clear()
+
+shards = {}
+
+def shard((t, lo, hi)):
+    stage = shards['stages'][t]
+    v, a = stage.backup(shards['v'][:len(stage.targets)], slice(lo, hi))
+    shards['values'][lo:hi] = v
+    shards['actions'][lo:hi] = a
+
+def bisection(E, us):
+    """
+    Return the least (E(u), u) over the sorted actions `us`, assuming E is convex in them.
+
+    Finds the first action from which E stops decreasing, so ties go to the least action.
+    """
+    lo, hi = 0, len(us) - 1
+    e = {}
+    while lo < hi:
+        mid = (lo + hi) // 2
+        for j in (mid, mid + 1):
+            if j not in e:
+                e[j] = E(us[j])
+        if e[mid + 1] >= e[mid]:
+            hi = mid
+        else:
+            lo = mid + 1
+    return e[lo] if lo in e else E(us[lo]), us[lo]
+
+def discount(gamma):
+    if not 0 <= gamma < 1:
+        raise ValueError("the discount factor must be in [0, 1): %r" % (gamma,))
+
+def irange(N=None):
+    return itertools.count() if N is None else xrange(N)
+
+def distance(v, v_):
+    """Return the max norm of `v - v_`, treating matching infinities as equal."""
+    with numpy.errstate(invalid='ignore'):
+        d = numpy.abs(v - v_)
+    return numpy.where(v == v_, 0, d).max() if len(d) else 0
+
+def span(d):
+    d = d[numpy.isfinite(d)]
+    return d.max() - d.min() if len(d) else 0
+
+def stationary(p, p_, tol):
+    """Return the constant by which the values of `p` exceed `p_`, if their actions agree, or None."""
+    if len(p) != len(p_):
+        return None
+    for x, (v, u) in p.items():
+        if x not in p_ or p_[x][1] != u:
+            return None
+    v = numpy.array([p[x][0] for x in p], dtype=float)
+    v_ = numpy.array([p_[x][0] for x in p], dtype=float)
+    with numpy.errstate(invalid='ignore'):
+        d = numpy.where(v == v_, 0, v - v_)
+    if not numpy.isfinite(d).all():
+        return None
+    if len(d) and d.max() - d.min() > tol:
+        return None
+    return (d.max() + d.min()) / 2. if len(d) else 0
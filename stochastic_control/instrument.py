@@ -0,0 +1,141 @@
+"""
+Instrumenting the solvers: per stage timings, call counts, throughput and memory.
+
+`decision.MDP.policy`, `bellman.policy` and `markov.values` take a `hook`,
+called with the `Stats` of each stage as soon as it is done.
+If the hook returns False, the solve stops there (otherwise it carries on).
+Without a hook, the solvers run exactly as before.
+For `markov.values`, which has no actions, the pairs are the (state, successor) transitions.
+
+>>> import decision
+>>> inf = float('inf')
+>>> C = 6
+>>> mdp = decision.MDP(50, lambda t: range(C + 1), W=lambda t, x, u: {0: .7, 1: .2, 2: .1})
+>>> mdp.step = lambda t, x, u, d: x - d + u
+>>> mdp.cost = lambda t, x, u, d: .1 * x + 1 * (u > 0) if 0 <= x - d + u <= C else inf
+>>> recorder = Recorder(limit=3)
+>>> mu = dict(mdp.policy(hook=recorder))
+>>> sorted(mu), [s.t for s in recorder.stats]
+([47, 48, 49], [49, 48, 47])
+>>> s = recorder.stats[-1]
+>>> s.calls == {'step': 7 * 7 * 3, 'cost': 7 * 7 * 3, 'W': 7 * 7}, s.pairs
+(True, 49)
+>>> s.rate > 0 and s.memory > 0
+True
+>>> mdp.step(0, 1, 2, 0)
+3
+
+Compiled, the enumeration happens once (per regime), so later stages make no calls:
+
+>>> recorder = Recorder(limit=3)
+>>> mdp.regime = lambda t: None
+>>> mu = dict(mdp.policy(compiled=True, hook=recorder))
+>>> [sum(s.calls.values()) for s in recorder.stats]
+[343, 0, 0]
+"""
+import sys
+import time
+
+class Stats(object):
+    """
+    What it took to solve stage `t`: the wall clock `seconds`, the `calls` made to each callable,
+    the (state, action) `pairs` evaluated, and so the `rate` of pairs per second,
+    and the (approximate) `memory` taken by the stage's policy dict, in bytes.
+    """
+    def __init__(self, t, seconds, calls, pairs, memory):
+        self.t = t
+        self.seconds = seconds
+        self.calls = calls
+        self.pairs = pairs
+        self.rate = pairs / seconds if seconds else float('inf')
+        self.memory = memory
+
+    def __repr__(self):
+        return ('Stats(t=%r, seconds=%.6f, calls=%r, pairs=%d, rate=%.0f, memory=%d)' %
+                (self.t, self.seconds, self.calls, self.pairs, self.rate, self.memory))
+
+class Recorder(object):
+    """
+    A hook that keeps the `Stats` of each stage, and optionally prints them as they come,
+    stopping after `limit` stages, or once `seconds` have been spent in all.
+    """
+    def __init__(self, limit=None, seconds=None, stream=None):
+        self.limit = limit
+        self.seconds = seconds
+        self.stream = stream
+        self.stats = []
+
+    def __call__(self, stats):
+        self.stats.append(stats)
+        if self.stream:
+            print >> self.stream, stats
+        if self.limit is not None and len(self.stats) >= self.limit:
+            return False
+        if self.seconds is not None and sum(s.seconds for s in self.stats) >= self.seconds:
+            return False
+
+    @property
+    def peak(self):
+        """The most memory taken by any stage."""
+        return max(s.memory for s in self.stats) if self.stats else 0
+
+class Counter(object):
+    """A callable counting the calls to `f`, under `name` in the dict `calls`."""
+    def __init__(self, f, name, calls):
+        self.f = f
+        self.name = name
+        self.calls = calls
+        calls.setdefault(name, 0)
+
+    def __call__(self, *args):
+        self.calls[self.name] += 1
+        return self.f(*args)
+
+class counting(object):
+    """Within the context, replace the callable attributes `names` of `obj` with `Counter`s."""
+    def __init__(self, obj, names):
+        self.obj = obj
+        self.names = names
+        self.calls = {}
+
+    def __enter__(self):
+        self.saved = dict((name, self.obj.__dict__[name]) for name in self.names if name in self.obj.__dict__)
+        for name in self.names:
+            setattr(self.obj, name, Counter(getattr(self.obj, name), name, self.calls))
+        return self.calls
+
+    def __exit__(self, *exc):
+        for name in self.names:
+            if name in self.saved:
+                setattr(self.obj, name, self.saved[name])
+            else:
+                delattr(self.obj, name)
+
+def stages(solve, hook, calls, pairs):
+    """
+    Yield the (t, p) stages of `solve`, reporting the `Stats` of each to `hook`.
+
+    The `calls` dict is updated by the `Counter`s of the solve, and `pairs(t, p)` counts the pairs of a stage.
+    """
+    solve = iter(solve)
+    while True:
+        before = dict(calls)
+        start = time.time()
+        try:
+            t, p = next(solve)
+        except StopIteration:
+            return
+        seconds = time.time() - start
+        yield t, p
+        counts = dict((name, n - before.get(name, 0)) for name, n in calls.items())
+        if hook(Stats(t, seconds, counts, pairs(t, p), sizeof(p))) is False:
+            return
+
+def sizeof(p):
+    """Return the (approximate) bytes taken by a stage dict, its values and their contents."""
+    size = sys.getsizeof(p)
+    for v in p.itervalues():
+        size += sys.getsizeof(v)
+        if isinstance(v, tuple):
+            size += sum(sys.getsizeof(x) for x in v)
+    return size
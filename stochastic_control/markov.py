@@ -30,6 +30,25 @@ By monte carlo:
 >>> 23 < e < 24
 True
 
+Or, many walks at once:
+>>> chain = MarkovChain(P)
+>>> S = chain.walks(pi0, T, N=1000, seed=1)
+>>> S.shape
+(1000, 51)
+>>> (S == chain.walks(pi0, T, N=1000, seed=1)).all()
+True
+>>> G_ = numpy.array([[g(t, x, T) for x in chain.states] for t in xrange(T + 1)])
+>>> e = G_[numpy.arange(T + 1), S].sum(axis=1).mean()
+>>> 23 < e < 24
+True
+
+Or, in parallel, until the estimate is accurate enough:
+>>> E = parallel_estimate(PathCost(chain, pi0, T, G_), se=.02, batch=500, processes=2, seed=1)
+>>> 23 < E.mean < 24, E.stderr <= .02, E.n % 500
+(True, True, 0)
+>>> E.mean == parallel_estimate(PathCost(chain, pi0, T, G_), se=.02, batch=500, processes=1, seed=1).mean
+True
+
 By distribution propagation:
 >>> pis = [pi0]
 >>> for t in xrange(T): pis.append(propf(pis[-1], P))
@@ -39,9 +58,39 @@ True
 >>> vs = list(values(T, X, P, g))
 >>> abs(vs[-1][6] - vs[-2][6] - .446) < 1e-2
 True
+>>> recorder = instrument.Recorder()
+>>> list(values(T, X, P, g, hook=recorder)) == vs
+True
+>>> len(recorder.stats), recorder.stats[-1].calls, recorder.stats[-1].pairs
+(51, {'g': 7}, 21)
+
+Or, with the chain, many distributions (or cost functions) at once:
+>>> Pi = chain.vector(pi0) * numpy.ones((2, 1))
+>>> Pis = list(chain.propagate(Pi, T))
+>>> Gs = numpy.array([G_[t] for t in xrange(T + 1)])
+>>> Js_ = (numpy.array(Pis) * Gs[:, None, :]).sum(axis=2).sum(axis=0)
+>>> abs(Js_ - 23.1286).max() < 1e-4
+True
+>>> vs_ = list(chain.values(T, lambda t: numpy.array([G_[t], 2 * G_[t]]).T))
+>>> abs(vs_[-1][chain.index[6]] - [vs[-1][6], 2 * vs[-1][6]]).max() < 1e-9
+True
+
+The average cost per stage is the expected stage cost under the stationary distribution,
+and the k-step transitions come from repeated squaring:
+>>> pi = chain.stationary()
+>>> abs(pi.dot(G_[0]) - .446) < 1e-2
+True
+>>> abs(chain.power(T).toarray()[chain.index[6]] - Pis[-1][0]).max() < 1e-12
+True
 """
+import collections
 import itertools
+import multiprocessing
 import random
+import time
+import numpy
+from scipy import sparse
+import instrument
 
 def dot(x, y):
     return sum(x[k] * y.get(k, 0) for k in x)
@@ -57,13 +106,33 @@ def cumsum(vs, s=0.0):
 def cumdist(pi):
     return dict((k, s) for k, s in zip(pi, cumsum(pi.values())))
 
+def alias(pi):
+    """
+    Return Walker's alias table for `pi`, as the lists (keys, prob, alias).
+
+    To sample, pick a slot `i` uniformly, and then either its own key (with probability `prob[i]`),
+    or else the key of the slot `alias[i]`.
+    """
+    keys = list(pi)
+    n, total = len(keys), float(sum(pi.values()))
+    scaled = [pi[k] * n / total for k in keys]
+    prob, other = [1.] * n, range(n)
+    small = [i for i, s in enumerate(scaled) if s < 1]
+    large = [i for i, s in enumerate(scaled) if s >= 1]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s], other[s] = scaled[s], l
+        scaled[l] -= 1 - scaled[s]
+        (small if scaled[l] < 1 else large).append(l)
+    return keys, prob, other
+
 def sample(pi, N=None):
-    def pick(u, c=cumdist(pi)):
-        for k, s in c.items():
-            if u <= s:
-                return k
+    keys, prob, other = alias(pi) if pi else ([None], [1.], [0])
+    n = len(keys)
     for i in irange(N):
-        yield pick(random.random())
+        u = random.random() * n
+        j = int(u)
+        yield keys[j] if u - j < prob[j] else keys[other[j]]
 
 def estimate(pi, f, N):
     return sum(f(x) for x in sample(pi, N)) / float(N)
@@ -82,11 +151,111 @@ def monte_carlo(f, X):
         pass
     return e / float(n + 1)
 
+class Moments(object):
+    """
+    The running count, mean and sum of squared deviations of a stream of observations.
+
+    Observations are added one at a time (Welford's algorithm),
+    or whole batches merged in (the pairwise update of Chan et al.).
+    """
+    def __init__(self, n=0, mean=0., m2=0.):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def of(cls, xs):
+        xs = numpy.asarray(xs, dtype=float)
+        return cls(len(xs), xs.mean(), ((xs - xs.mean()) ** 2).sum()) if len(xs) else cls()
+
+    def add(self, x):
+        self.n += 1
+        d = x - self.mean
+        self.mean += d / self.n
+        self.m2 += d * (x - self.mean)
+        return self
+
+    def merge(self, other):
+        n = self.n + other.n
+        if n:
+            d = other.mean - self.mean
+            self.mean += d * other.n / n
+            self.m2 += other.m2 + d * d * self.n * other.n / n
+            self.n = n
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else float('inf')
+
+    @property
+    def stderr(self):
+        return (self.variance / self.n) ** .5 if self.n > 1 else float('inf')
+
+class Estimate(collections.namedtuple('Estimate', 'mean stderr halfwidth n rate')):
+    """A Monte Carlo estimate, its standard error and confidence half-width, the samples used and samples per second."""
+
+def parallel_estimate(f, se=None, halfwidth=None, z=1.96, batch=1000, processes=None, seed=None, limit=None):
+    """
+    Estimate the mean of the observations returned by `f(random, N)`, sampling in parallel.
+
+    Each batch of `N` observations is drawn on a process pool, from its own substream
+    `random = numpy.random.RandomState([seed, i])`, so `f` must be picklable.
+    Batches are merged in order, stopping as soon as the standard error is within `se`,
+    or the confidence half-width (`z` standard errors) is within `halfwidth`,
+    or `limit` samples have been drawn.
+    The result depends only on the `seed`, not on the number of processes.
+    """
+    if se is None and halfwidth is None and limit is None:
+        raise ValueError("need a standard error, half-width or limit to stop at")
+    seed = numpy.random.randint(2 ** 31) if seed is None else seed
+    done = lambda m: ((se is not None and m.stderr <= se) or
+                      (halfwidth is not None and z * m.stderr <= halfwidth) or
+                      (limit is not None and m.n >= limit))
+    moments, start = Moments(), time.time()
+    if processes == 1:
+        for i in itertools.count():
+            if done(moments.merge(batch_moments(f, seed, i, batch))):
+                break
+    else:
+        processes = processes or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(processes)
+        try:
+            pending = collections.deque(pool.apply_async(batch_moments, (f, seed, i, batch))
+                                        for i in xrange(processes * 2))
+            for i in itertools.count(len(pending)):
+                if done(moments.merge(pending.popleft().get())):
+                    break
+                pending.append(pool.apply_async(batch_moments, (f, seed, i, batch)))
+        finally:
+            pool.terminate()
+    elapsed = time.time() - start
+    return Estimate(moments.mean, moments.stderr, z * moments.stderr, moments.n,
+                    moments.n / elapsed if elapsed else float('inf'))
+
+def batch_moments(f, seed, i, N):
+    return Moments.of(f(numpy.random.RandomState([seed, i]), N))
+
+class PathCost(object):
+    """The total costs `G[t, x]` of `N` walks on a `MarkovChain` from `pi0`, as observations for `parallel_estimate`."""
+    def __init__(self, chain, pi0, T, G):
+        self.chain = chain
+        self.pi0 = pi0
+        self.T = T
+        self.G = G
+
+    def __call__(self, random, N):
+        S = self.chain.walks(self.pi0, self.T, N, seed=random)
+        return self.G[numpy.arange(self.T + 1), S].sum(axis=1)
+
 def rwalk(pi0, P, T):
+    samplers = {}
     x = next(sample(pi0))
     yield x
     for t in xrange(T):
-        x = next(sample(P.get(x, {})))
+        if x not in samplers:
+            samplers[x] = sample(P.get(x, {}))
+        x = next(samplers[x])
         yield x
 
 def propf(pi, P):
@@ -99,10 +268,158 @@ def propf(pi, P):
 def propr(P, v):
     return dict((i, dot(p, v)) for i, p in P.items())
 
-def values(T, X, P, g):
-    v = dict((x, g(T, x, T)) for x in X)
-    yield v
-    for t in reversed(xrange(T)):
-        r = propr(P, v)
-        v = dict((x, g(t, x, T) + r.get(x, 0)) for x in X)
+def values(T, X, P, g, hook=None):
+    X = list(X)
+    if hook is not None:
+        calls = {}
+        g = instrument.Counter(g, 'g', calls)
+        nnz = sum(len(P.get(x, {})) for x in X)
+        stages = itertools.izip(reversed(xrange(T + 1)), values(T, X, P, g))
+        for t, v in instrument.stages(stages, hook, calls, lambda t, v: nnz):
+            yield v
+        return
+    chain = MarkovChain(P, X)
+    for v in chain.values(T, lambda t: numpy.array([g(t, x, T) for x in X], dtype=float)):
+        yield dict(zip(X, v.tolist()))
+
+class MarkovChain(object):
+    """
+    A Markov chain, with the transitions `P` stored as a sparse (CSR) matrix over indexed states.
+
+    Unless the `states` are given, they are those of `P` and all of their successors,
+    otherwise the chain is restricted to them (dropping any transitions that leave).
+    Distributions are row vectors (or matrices of them), values are column vectors (or matrices).
+
+    For sampling, each state also gets a row of alias tables over its successors
+    (padded to the widest row), so a step of any number of walks is a few array operations.
+    States without successors stay where they are.
+    """
+    def __init__(self, P, states=None):
+        if states is None:
+            states, seen = list(P), set(P)
+            for x in states:
+                for y in P.get(x, {}):
+                    if y not in seen:
+                        seen.add(y)
+                        states.append(y)
+        self.states = list(states)
+        self.index = dict((x, i) for i, x in enumerate(self.states))
+        S = len(self.states)
+        entries = [(i, self.index[y], q)
+                   for i, x in enumerate(self.states)
+                   for y, q in P.get(x, {}).items() if y in self.index]
+        i, j, q = zip(*entries) if entries else ((), (), ())
+        self.P = sparse.csr_matrix((q, (i, j)), shape=(S, S), dtype=float)
+        self.sampler = None
+
+    def vector(self, pi):
+        """Return the dict `pi` as a vector over the states, ignoring those not in the chain."""
+        v = numpy.zeros(len(self.states))
+        for x, p in pi.items():
+            if x in self.index:
+                v[self.index[x]] = p
+        return v
+
+    def todict(self, v):
+        """Return the vector `v` as a dict, over the states where it is nonzero."""
+        return dict((self.states[i], v[i]) for i in numpy.flatnonzero(v))
+
+    def propf(self, pi):
+        """Propagate the distribution(s) `pi` forward one step."""
+        return self.P.T.dot(pi.T).T
+
+    def propr(self, v):
+        """Propagate the value(s) `v` backward one step."""
+        return self.P.dot(v)
+
+    def propagate(self, pi, T):
+        """Yield the distribution(s) `pi` at times 0, ..., T."""
+        yield pi
+        for t in xrange(T):
+            pi = self.propf(pi)
+            yield pi
+
+    def values(self, T, g):
+        """
+        Yield the expected costs-to-go at times T, ..., 0, given the stage costs `g(t)`.
+
+        The stage costs are vectors over the states, or matrices with a column per cost function.
+        """
+        v = g(T)
         yield v
+        for t in reversed(xrange(T)):
+            v = g(t) + self.propr(v)
+            yield v
+
+    def power(self, k):
+        """Return the k-step transition matrix, by repeated squaring."""
+        Q, P = sparse.identity(len(self.states), format='csr'), self.P
+        while k:
+            if k & 1:
+                Q = Q.dot(P)
+            k >>= 1
+            if k:
+                P = P.dot(P)
+        return Q
+
+    def stationary(self, pi=None, tol=1e-10, limit=None):
+        """
+        Return a stationary distribution, by iterating the lazy chain (P + I) / 2 from `pi`.
+
+        The lazy chain has the same stationary distributions, but is aperiodic.
+        Starts from the uniform distribution, unless given, and stops once successive
+        distributions are within `tol` (in total variation).
+        """
+        pi = numpy.ones(len(self.states)) / len(self.states) if pi is None else pi
+        for n in irange(limit):
+            pi_ = (pi + self.propf(pi)) / 2.
+            if abs(pi_ - pi).sum() / 2. <= tol:
+                break
+            pi = pi_
+        return pi_
+
+    def alias_tables(self):
+        if self.sampler is None:
+            P, S = self.P, len(self.states)
+            rows = [dict(zip(P.indices[P.indptr[i]:P.indptr[i + 1]], P.data[P.indptr[i]:P.indptr[i + 1]])) or {i: 1.}
+                    for i in xrange(S)]
+            self.sampler = tables(rows)
+        return self.sampler
+
+    def draw(self, pi, N, random):
+        """Return `N` state indices drawn from the distribution `pi`, using `random` (a RandomState)."""
+        succ, prob, other, size = tables([dict((self.index[x], p) for x, p in pi.items())])
+        j = random.randint(size[0], size=N)
+        return succ[0, numpy.where(random.random_sample(N) < prob[0, j], j, other[0, j])]
+
+    def walks(self, pi0, T, N=1, seed=None):
+        """
+        Return `N` random walks of length `T` from `pi0`, as an (N, T + 1) array of state indices.
+
+        The walks are reproducible, given the same `seed` (or drawn from it, if it is a RandomState).
+        """
+        succ, prob, other, size = self.alias_tables()
+        random = seed if isinstance(seed, numpy.random.RandomState) else numpy.random.RandomState(seed)
+        X = numpy.empty((N, T + 1), dtype=int)
+        X[:, 0] = self.draw(pi0, N, random)
+        for t in xrange(T):
+            x = X[:, t]
+            u = random.random_sample(N) * size[x]
+            j = u.astype(int)
+            X[:, t + 1] = succ[x, numpy.where(u - j < prob[x, j], j, other[x, j])]
+        return X
+
+def tables(rows):
+    """Return the alias tables of each distribution over indices in `rows`, as padded (succ, prob, alias, size) arrays."""
+    K = max(len(pi) for pi in rows)
+    succ = numpy.zeros((len(rows), K), dtype=int)
+    prob = numpy.ones((len(rows), K))
+    other = numpy.zeros((len(rows), K), dtype=int)
+    size = numpy.zeros(len(rows), dtype=int)
+    for i, pi in enumerate(rows):
+        keys, p, a = alias(pi)
+        n = size[i] = len(keys)
+        succ[i, :n] = keys
+        prob[i, :n] = p
+        other[i, :n] = a
+    return succ, prob, other, size
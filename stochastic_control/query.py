@@ -1,6 +1,23 @@
 """
 Active query example from: http://www.stanford.edu/class/ee365/lectures/active_query.pdf
+
+Rounding beliefs down to the grid takes a fine grid to get accurate costs,
+interpolating between grid points gets there with a much coarser one:
+
+>>> fine = dict(Designer(N=100000).policy(compiled=True))[0][60000]
+>>> rounded = dict(Designer(N=1000).policy(compiled=True))[0][600]
+>>> interpolated = dict(Designer(N=1000, interpolate=True).policy(compiled=True))[0][600]
+>>> abs(rounded[0] - fine[0]) > 3e-3, abs(interpolated[0] - fine[0]) < 1e-3, interpolated[1] == fine[1]
+(True, True, True)
+
+The stages are built straight from the outcome arrays, and solve as the enumerated `W` does:
+
+>>> designer = Designer(N=200, interpolate=True)
+>>> compiled, interpreted = dict(designer.policy(compiled=True)), dict(designer.policy())
+>>> max(abs(compiled[t][n][0] - interpreted[t][n][0]) for t in compiled for n in compiled[t]) < 1e-12
+True
 """
+import numpy
 import decision
 
 class Designer(decision.MDP):
@@ -9,27 +26,81 @@ class Designer(decision.MDP):
              (.05, .05, 7),
              (.50, .50, 0)]
 
-    def __init__(self, T=3, prior=.6, rho=100, N=1000):
+    def __init__(self, T=3, prior=.6, rho=100, N=1000, interpolate=False):
+        """
+        Beliefs (the probability that the hypothesis holds) live on a grid of N + 1 points.
+
+        The posterior after each test outcome is rounded down to the grid,
+        unless `interpolate`, in which case its probability is split between the grid points around it,
+        in proportion to their distance, so a coarser grid gives the same accuracy.
+        """
+        p = numpy.arange(N + 1) / float(N)
+        def transition(q):
+            parts = []
+            for y in (0, 1):
+                b = q[0][y] * (1 - p) + q[1][y] * p
+                f = q[1][y] * p / b * N
+                n = f.astype(int)
+                if interpolate:
+                    r = f - n
+                    parts.extend([(n, b * (1 - r)), (numpy.minimum(n + 1, N), b * r)])
+                else:
+                    parts.append((n, b))
+            return parts
+        def table(parts):
+            parts = [(n.tolist(), b.tolist()) for n, b in parts]
+            rows = []
+            for m in xrange(N + 1):
+                pi = {}
+                for n, b in parts:
+                    if b[m]:
+                        pi[n[m]] = pi.get(n[m], 0) + b[m]
+                rows.append(pi)
+            return rows
         Q = [{0: {0: 1 - a, 1: a},
               1: {0: b, 1: 1 - b}}
              for a, b, c in self.tests]
-        def transition(p, q):
-            pi = {}
-            for y in (0, 1):
-                b = q[0][y] * (1 - p) + q[1][y] * p
-                f = q[1][y] * p / b
-                n = int(f * N)
-                pi[n] = pi.get(n, 0) + b
-            return pi
-        self.ptrans = ptrans = dict(((n, k), transition(n / float(N), Q[k]))
-                                    for n in range(N + 1)
-                                    for k in range(len(self.tests)))
+        def W(t, n, k):
+            if not ptrans:
+                ptrans.update(((m, j), pi)
+                              for j, parts in enumerate(self.outcomes)
+                              for m, pi in enumerate(table(parts)))
+            return ptrans[n, k]
+        self.outcomes = [transition(q) for q in Q]
+        self.ptrans = ptrans = {}
         self.r = rho / float(N)
         self.N = N
         self.T = T
         self.X = lambda t: range(N + 1)
         self.U = lambda t, n: range(len(self.tests))
-        self.W = lambda t, n, k: ptrans[n, k]
+        self.W = W
+
+    def tabulate(self, t, costs=None):
+        """
+        Build the stage arrays straight from the outcome arrays, rather than enumerating `W`
+        (which is only tabulated, into `ptrans`, when first called).
+
+        Outcome parts landing on the same grid point are merged into one successor, as in `W`;
+        the sums still run in a different order, so exact ties between tests may be broken differently.
+        """
+        if costs is not None:
+            return super(Designer, self).tabulate(t, costs)
+        N, K = self.N, len(self.tests)
+        succ = numpy.array([[n for n, b in parts] for parts in self.outcomes]).transpose(2, 0, 1)
+        prob = numpy.array([[b for n, b in parts] for parts in self.outcomes]).transpose(2, 0, 1)
+        for k in xrange(1, succ.shape[2]):
+            for j in xrange(k):
+                same = succ[:, :, j] == succ[:, :, k]
+                prob[:, :, j] += numpy.where(same, prob[:, :, k], 0)
+                prob[:, :, k][same] = 0
+        cost = numpy.zeros(succ.shape) + numpy.array([c for a, b, c in self.tests])[:, None]
+        if t == self.T - 1:
+            cost += self.r * numpy.minimum(succ, N - succ)
+        states = range(N + 1)
+        return decision.Stage.build(states, [range(K)] * len(states), states, succ, cost, prob, prob > 0)
+
+    def regime(self, t):
+        return t == self.T - 1
 
     def step(self, t, n, k, n_):
         return n_
@@ -54,6 +125,6 @@ def plot(policy, T=0, alpha=.1):
 
 if __name__ == '__main__':
     designer = Designer()
-    policy = dict(designer.policy())
+    policy = dict(designer.policy(compiled=True))
     for t in range(designer.T):
         plot(policy, t)
@@ -0,0 +1,117 @@
+"""
+Closed-loop simulation of solved Markov Decision Problems.
+
+Inventory, from `decision`, run under its optimal policy:
+
+>>> import decision
+>>> inf = float('inf')
+>>> T = 50
+>>> C = 6
+>>> mdp = decision.MDP(T, lambda t: range(C + 1), W=lambda t, x, u: {0: .7, 1: .2, 2: .1})
+>>> mdp.step = lambda t, x, u, d: x - d + u
+>>> mdp.cost = lambda t, x, u, d: .1 * x + 1 * (u > 0) if 0 <= x - d + u <= C else inf
+>>> mu = dict(mdp.policy(compiled=True))
+>>> rollout = simulate(mdp, mu, 6, N=4000, seed=1)
+>>> rollout.paths.shape, rollout.actions.shape, rollout.costs.shape
+((4000, 51), (4000, 50), (4000, 50))
+>>> s = rollout.summary()
+>>> abs(s['mean'] - mu[0][6][0]) < 3 * s['stderr']
+True
+>>> (rollout.exits == -1).all()
+True
+
+Trajectories that end outside X(T) exit at T:
+
+>>> mdp.X = lambda t: range(C + 1) if t < T else [0]
+>>> rollout = simulate(mdp, mu, 6, N=100, seed=1)
+>>> ((rollout.exits == T) == (rollout.paths[:, -1] != rollout.index[0])).all()
+True
+>>> all((rollout.actions[:, t][rollout.paths[:, t] == rollout.index[0]] == 4).all() for t in range(T - 2))
+True
+"""
+import numpy
+
+class Rollout(object):
+    """
+    Simulated trajectories: `paths` of state indices (into `states`), the `actions` taken,
+    and the stage `costs` incurred, each with a row per trajectory and a column per stage.
+
+    A trajectory that leaves X(t) stops there, as the backups assume (it is worth nothing after):
+    `exits` holds the first t at which it is outside, or -1 if it never is.
+    Afterwards, its state stays put, its costs are zero and its actions are meaningless.
+    """
+    def __init__(self, states, paths, actions, costs, exits):
+        self.states = states
+        self.index = dict((x, i) for i, x in enumerate(states))
+        self.paths = paths
+        self.actions = actions
+        self.costs = costs
+        self.exits = exits
+
+    @property
+    def totals(self):
+        return self.costs.sum(axis=1)
+
+    def summary(self, quantiles=(.05, .25, .5, .75, .95)):
+        """Return summary statistics of the total costs of the trajectories."""
+        totals = self.totals
+        N = len(totals)
+        return {'N': N,
+                'mean': totals.mean(),
+                'std': totals.std(ddof=1) if N > 1 else 0.,
+                'stderr': totals.std(ddof=1) / N ** .5 if N > 1 else float('inf'),
+                'min': totals.min(),
+                'max': totals.max(),
+                'quantiles': dict(zip(quantiles, numpy.percentile(totals, [100 * q for q in quantiles])))}
+
+def simulate(mdp, policy, x0, N=1000, seed=None):
+    """
+    Roll out `N` trajectories of `mdp`, under `policy`, from the state `x0` (or a distribution over states).
+
+    The policy gives the (value, action) of each state for each t, as from `dict(mdp.policy())`
+    or a `tables.PolicyTable`. Each stage is compiled once (per regime), so each step of the
+    trajectories is a few array operations: disturbances are drawn from `W(t, x, u)` by inverse CDF.
+    """
+    random = seed if isinstance(seed, numpy.random.RandomState) else numpy.random.RandomState(seed)
+    stages = mdp.stages()
+    states, index = [], {}
+    def globalize(xs):
+        for x in xs:
+            if x not in index:
+                index[x] = len(states)
+                states.append(x)
+        return numpy.array([index[x] for x in xs], dtype=int)
+    pi0 = x0 if isinstance(x0, dict) else {x0: 1.}
+    keys = globalize(list(pi0))
+    p = numpy.array(pi0.values(), dtype=float)
+    paths = numpy.empty((N, mdp.T + 1), dtype=int)
+    paths[:, 0] = keys[random.choice(len(keys), size=N, p=p / p.sum())]
+    costs = numpy.zeros((N, mdp.T))
+    exits = -numpy.ones(N, dtype=int)
+    actions, seen = None, {}
+    for t in xrange(mdp.T):
+        stage = stages(t)
+        if stage not in seen:
+            seen[stage] = globalize(stage.states), globalize(stage.targets)
+        sources, targets = seen[stage]
+        local = -numpy.ones(len(states), dtype=int)
+        local[sources] = numpy.arange(len(sources))
+        i = local[paths[:, t]]
+        exits[(i < 0) & (exits < 0)] = t
+        live = exits < 0
+        i = numpy.where(live, i, 0)
+        a = stage.indices(policy[t])
+        us = numpy.array(stage.choose(a))
+        if actions is None:
+            actions = numpy.zeros((N, mdp.T), dtype=us.dtype)
+        j = a[i]
+        cum = numpy.cumsum(stage.prob[i, j], axis=1)
+        k = (cum <= random.random_sample(N)[:, None] * cum[:, -1:]).sum(axis=1)
+        actions[:, t] = us[i]
+        costs[live, t] = stage.cost[i, j, k][live]
+        paths[:, t + 1] = numpy.where(live, targets[stage.succ[i, j, k]], paths[:, t])
+    terminal = globalize(list(mdp.X(mdp.T)))
+    final = numpy.zeros(len(states), dtype=bool)
+    final[terminal] = True
+    exits[~final[paths[:, -1]] & (exits < 0)] = mdp.T
+    return Rollout(states, paths, actions, costs, exits)
@@ -0,0 +1,236 @@
+"""
+Compact policy tables, for solved (finite horizon) problems.
+
+A policy, as yielded by `decision.MDP.policy` or `bellman.policy`, holds a dict of (value, action) per stage.
+A table holds the same, as one contiguous block with a row per stage and a column per state:
+the values (as floats) followed by the action indices (as int32, into `actions`).
+Tables can be saved and reopened (memory-mapped) without solving again:
+
+>>> import os, tempfile
+>>> import bellman
+>>> inf = float('inf')
+>>> nodes = list('abcd')
+>>> edges = {'ab': 2, 'ac': 6, 'bc': 3, 'bd': 8, 'cb': 1, 'cd': 4, 'dd': 0}
+>>> step = lambda t, x, u, T: u
+>>> cost = lambda t, x, u, T: edges.get(x + u, inf) if t < T - 1 else (0 if x == 'd' else inf)
+>>> p = dict(bellman.policy(T=4, X=lambda t: nodes, U=lambda t, x: nodes, f=step, g=cost))
+>>> table = PolicyTable.build(bellman.policy(T=4, X=lambda t: nodes, U=lambda t, x: nodes, f=step, g=cost))
+>>> table[0]['a'], table[2]['a']
+((9.0, 'b'), (inf, 'a'))
+>>> path = os.path.join(tempfile.mkdtemp(), 'policy')
+>>> table.save(path)
+>>> mu = PolicyTable.open(path)
+>>> dict((t, dict(mu[t].items())) for t in range(len(mu))) == p
+True
+>>> os.remove(path)
+
+The states and actions are saved as arrays, so tuples of numbers (say) come back as they went,
+but states of mixed kinds cannot be saved:
+
+>>> grid = PolicyTable.build([(0, {(q, n): (q + n / 10., q - 1) for q in range(3) for n in range(2)})])
+>>> grid.save(path)
+>>> mu = PolicyTable.open(path)
+>>> mu[0][(2, 1)], (2, 2) in mu[0], len(mu[0])
+((2.1, 1), False, 6)
+>>> PolicyTable.build([(0, {1: (0., 1), (1, 2): (0., 1)})]).save(path)
+Traceback (most recent call last):
+    ...
+ValueError: only numbers, strings, or tuples of numbers (of one length) can be saved as keys
+>>> os.remove(path)
+"""
+import ast
+import bisect
+import struct
+import numpy
+
+MAGIC = 'PHDPOLICY'
+VERSION = 2
+ALIGN = 64
+
+class PolicyTable(object):
+    """
+    The values and choices of each stage, with a column per state, the states in sorted order
+    (so that a state is found by bisection, and an opened table need not index them).
+    """
+    def __init__(self, states, actions, values, choices):
+        self.states = states
+        self.actions = actions
+        self.values = values
+        self.choices = choices
+
+    @classmethod
+    def build(cls, policy, dtype=numpy.float64):
+        """
+        Build a table from the (t, p) pairs of a policy, one stage at a time.
+
+        States missing from a stage have no action (index -1), and a value of nan.
+        """
+        states, actions = [], []
+        sindex, aindex = {}, {}
+        def index(x, keys, index):
+            if x not in index:
+                index[x] = len(keys)
+                keys.append(x)
+            return index[x]
+        rows = {}
+        for t, p in policy:
+            rows[t] = (numpy.array([index(x, states, sindex) for x in p], dtype=int),
+                       numpy.array([v for v, u in p.values()], dtype=dtype),
+                       numpy.array([index(u, actions, aindex) for v, u in p.values()], dtype=numpy.int32))
+        T, S = max(rows) + 1 if rows else 0, len(states)
+        order = sorted(xrange(S), key=states.__getitem__)
+        rank = numpy.empty(S, dtype=int)
+        rank[order] = numpy.arange(S)
+        block = allocate(T, S, dtype)
+        values, choices = views(block, T, S, dtype)
+        values[:] = numpy.nan
+        choices[:] = -1
+        for t, (i, v, a) in rows.items():
+            values[t, rank[i]] = v
+            choices[t, rank[i]] = a
+        return cls([states[i] for i in order], actions, values, choices)
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        """Open a saved table, with the values, choices, states and actions memory-mapped from `path`."""
+        with open(path, 'rb') as file:
+            header, offset = read_header(file, 'policy table')
+        T, S, dtype = header['T'], header['S'], numpy.dtype(header['dtype'])
+        block = numpy.memmap(path, dtype=numpy.uint8, mode=mode, offset=offset, shape=(nbytes(T, S, dtype),))
+        values, choices = views(block, T, S, dtype)
+        offset, keys = offset + nbytes(T, S, dtype), []
+        for kind in ('states', 'actions'):
+            kdtype, shape = header[kind]
+            offset = aligned(offset)
+            keys.append(Keys(numpy.memmap(path, dtype=kdtype, mode='r', offset=offset, shape=shape).view(numpy.ndarray)
+                             if numpy.prod(shape) else numpy.zeros(shape, dtype=kdtype)))
+            offset += int(numpy.prod(shape)) * numpy.dtype(kdtype).itemsize
+        return cls(keys[0], keys[1], values, choices)
+
+    def save(self, path):
+        """
+        Save the table to `path`, in the format read by `open`.
+
+        The states and actions are saved as arrays, so they must be numbers, strings,
+        or tuples of numbers (all of the same length).
+        """
+        T, S = self.values.shape
+        states, actions = keyarray(self.states), keyarray(self.actions)
+        with open(path, 'wb') as file:
+            write_header(file, {'T': T, 'S': S,
+                                'dtype': self.values.dtype.str,
+                                'states': (states.dtype.str, states.shape),
+                                'actions': (actions.dtype.str, actions.shape)})
+            file.write(numpy.ascontiguousarray(self.values).tostring())
+            file.write(numpy.ascontiguousarray(self.choices).tostring())
+            for array in (states, actions):
+                pad(file)
+                file.write(array.tostring())
+
+    def find(self, x):
+        """The column of the state `x`, or -1."""
+        i = bisect.bisect_left(self.states, x)
+        return i if i < len(self.states) and self.states[i] == x else -1
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, t):
+        return StageTable(self, t)
+
+    def __iter__(self):
+        return iter(xrange(len(self)))
+
+    def items(self):
+        return [(t, self[t]) for t in self]
+
+class StageTable(object):
+    """A read-only, dict-like view of a single stage of a `PolicyTable`."""
+    def __init__(self, table, t):
+        self.table = table
+        self.value = table.values[t]
+        self.choice = table.choices[t]
+
+    def __getitem__(self, x):
+        i = self.table.find(x)
+        if i < 0 or self.choice[i] < 0:
+            raise KeyError(x)
+        return float(self.value[i]), self.table.actions[self.choice[i]]
+
+    def __contains__(self, x):
+        i = self.table.find(x)
+        return i >= 0 and self.choice[i] >= 0
+
+    def __iter__(self):
+        return (x for x, a in zip(self.table.states, self.choice) if a >= 0)
+
+    def __len__(self):
+        return int((self.choice >= 0).sum())
+
+    def get(self, x, default=None):
+        return self[x] if x in self else default
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[x] for x in self]
+
+    def items(self):
+        return [(x, self[x]) for x in self]
+
+class Keys(object):
+    """A read-only sequence of keys (numbers, strings, or tuples of numbers), held as an array with a row per key."""
+    def __init__(self, array):
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, i):
+        key = self.array[i].tolist()
+        return tuple(key) if isinstance(key, list) else key
+
+    def __iter__(self):
+        return (self[i] for i in xrange(len(self)))
+
+def keyarray(keys):
+    """The array holding the `keys`, or a ValueError if they would not come back from it as they are."""
+    if isinstance(keys, Keys):
+        return keys.array
+    array = numpy.array(list(keys)) if len(keys) else numpy.zeros(0)
+    back = array.tolist() if array.ndim < 2 else map(tuple, array.tolist())
+    if array.dtype == object or array.ndim > 2 or back != list(keys):
+        raise ValueError("only numbers, strings, or tuples of numbers (of one length) can be saved as keys")
+    return array
+
+def nbytes(T, S, dtype):
+    return T * S * (numpy.dtype(dtype).itemsize + 4)
+
+def allocate(T, S, dtype):
+    return numpy.zeros(nbytes(T, S, dtype), dtype=numpy.uint8)
+
+def views(block, T, S, dtype):
+    split = T * S * numpy.dtype(dtype).itemsize
+    return block[:split].view(dtype).reshape(T, S), block[split:].view(numpy.int32).reshape(T, S)
+
+def write_header(file, header):
+    """Write MAGIC, VERSION and the repr'd `header` dict, padded to the start of the first block."""
+    header = repr(header)
+    file.write(struct.pack('<%dsII' % len(MAGIC), MAGIC, VERSION, len(header)))
+    file.write(header)
+    pad(file)
+
+def read_header(file, what):
+    """Read what `write_header` wrote, and return the header dict and the offset of the first block."""
+    magic, version, size = struct.unpack('<%dsII' % len(MAGIC), file.read(len(MAGIC) + 8))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a %s (version %s): %s" % (what, VERSION, file.name))
+    return ast.literal_eval(file.read(size)), aligned(len(MAGIC) + 8 + size)
+
+def pad(file):
+    """Write zeros up to the next multiple of ALIGN bytes."""
+    file.write('\0' * (aligned(file.tell()) - file.tell()))
+
+def aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
@@ -1,5 +1,13 @@
 """
 Trading example from: http://www.stanford.edu/class/ee365/lectures/trading.pdf
+
+The cost-to-go is convex in the action (except with the short-holding fee),
+and the optimal action never grows with the holdings (except with the nonlinear cost),
+so the backups can search far fewer actions, for the same policy:
+
+>>> traders = [trader(T=10) for trader in (Trader, TraderSH, TraderLin, TraderSHNL)]
+>>> [dict(trader.policy()) == dict(trader.policy(compiled=True)) for trader in traders]
+[True, True, True, True]
 """
 import math
 import decision
@@ -17,11 +25,22 @@ class Trader(decision.MDP):
         prices = self.prices = dict((n, (1 + gamma) ** n) for n in range(-N, N + 1))
         ptrans = self.ptrans = dict((n, transition(n)) for n in range(-N, N + 1))
         states = [(q, n) for q in range(qmin, qmax + 1) for n in range(-N, N + 1)]
+        self.qmin = qmin
         self.T = T
         self.X = lambda t: states
         self.U = lambda t, (q, n): range(qmin - q, qmax - q + 1)
         self.W = lambda t, (q, n), u: ptrans[n]
 
+    def regime(self, t):
+        return t == self.T - 1
+
+    def convex(self, t):
+        return t < self.T - 1
+
+    def neighbor(self, t, (q, n)):
+        if q > self.qmin:
+            return (q - 1, n), -1
+
     def step(self, t, (q, n), u, n_):
         return q + u, n_
 
@@ -31,6 +50,9 @@ class Trader(decision.MDP):
         return 0 if q + u == 0 else inf
 
 class TraderSH(Trader):
+    def convex(self, t):
+        return False
+
     def cost(self, t, (q, n), u, n_):
         if t < self.T - 1:
             return u * self.prices[n] + (.005 if q < 0 else 0)
@@ -43,6 +65,9 @@ class TraderLin(Trader):
         return 0 if q + u == 0 else inf
 
 class TraderSHNL(Trader):
+    def neighbor(self, t, (q, n)):
+        pass
+
     def cost(self, t, (q, n), u, n_):
         if t < self.T - 1:
             return u * self.prices[n] + (.0001 if q < 0 else 0) + (.005 * abs(u) ** 1.5)
@@ -61,5 +86,10 @@ def plot(policy, T=0):
     pylab.show()
 
 if __name__ == '__main__':
-    for trader in (Trader, TraderSH, TraderLin, TraderSHNL):
-        plot(dict(trader(T=25).policy()))
+    traders = [trader(T=25) for trader in (Trader, TraderSH, TraderLin, TraderSHNL)]
+    policies = [{} for trader in traders]
+    for t, ps in traders[0].sweep([trader.cost for trader in traders]):
+        for policy, p in zip(policies, ps):
+            policy[t] = p
+    for policy in policies:
+        plot(policy)